@@ -0,0 +1,127 @@
+from datetime import datetime
+import json, os, random
+
+
+OUTPUT_FILENAME_FORMAT = "message_{}.json"
+START_DATE = datetime(2016, 1, 1)
+MS_PER_YEAR = 365 * 24 * 60 * 60 * 1000
+
+FIRST_NAMES = ["Alice", "Bob", "Carol", "Dan", "Eve", "Frank", "Grace", "Heidi", "Iván", "Judy", "Ken", "Léa", \
+    "Mallory", "Niaj", "Olivia", "Peggy", "Renée", "Sybil", "Trent", "Victor", "Walter", "Zoë"]
+LAST_NAMES = ["Smith", "Jones", "García", "Brown", "Müller", "Nguyen", "Kowalski", "Dubois", "Rossi", "Sato"]
+WORDS = ["the", "a", "to", "and", "you", "I", "is", "it", "that", "lol", "haha", "yes", "no", "what", "when", \
+    "tonight", "tomorrow", "dinner", "pizza", "movie", "game", "party", "work", "class", "exam", "coffee", \
+    "café", "naïve", "déjà", "vu", "don’t", "can’t", "it’s", "“really”", "omg", "wait", "where", "ok", \
+    "😂", "❤", "👍", "🎉", "🙄", "2", "10", "Friday", "Saturday", "beach", "trip", "photo", "song"]
+REACTIONS = ["😆", "😍", "😮", "😢", "😠", "👍", "👎", "❤"]
+MEDIA_FIELDS = ["photos", "videos", "gifs"]
+
+# JSON field names
+PARTICIPANTS = "participants"
+MESSAGES = "messages"
+PARTICIPANT_NAME = "name"
+SENDER_NAME = "sender_name"
+TIMESTAMP_MS = "timestamp_ms"
+MESSAGE_TYPE = "type"
+MESSAGE_CONTENT = "content"
+REACTIONS_FIELD = "reactions"
+REACTION = "reaction"
+ACTOR = "actor"
+URI = "uri"
+
+
+"""
+Writes a fake Messenger group chat export with the same layout as Facebook's:
+`message_1.json` holds the newest messages, each file lists its messages newest
+first, and all strings are UTF-8 bytes escaped as latin1 code points (mojibake).
+
+Participants are active with Zipf-like weights, so a few people send most of the
+messages, and gaps between messages vary widely so that some days are busy and
+some are empty. The same seed always generates the same export.
+"""
+class SyntheticExportGenerator:
+    def __init__(self, num_messages=10000, num_participants=8, num_years=3, reaction_density=0.3, \
+            media_ratio=0.1, messages_per_file=10000, seed=0):
+        self.num_messages = num_messages
+        self.num_participants = num_participants
+        self.num_years = num_years
+        self.reaction_density = reaction_density
+        self.media_ratio = media_ratio
+        self.messages_per_file = messages_per_file
+        self.random = random.Random(seed)
+        self.participants = self.__get_participant_names()
+        self.activity_weights = [1 / (i + 1) for i in range(num_participants)]
+        return
+
+
+    def generate(self, output_directory_path):
+        if not os.path.exists(output_directory_path):
+            os.makedirs(output_directory_path)
+
+        num_files = max((self.num_messages + self.messages_per_file - 1) // self.messages_per_file, 1)
+        mean_gap_ms = self.num_years * MS_PER_YEAR / max(self.num_messages, 1)
+        timestamp = int(START_DATE.timestamp() * 1000)
+
+        # Oldest messages go to the last file
+        for file_index in range(num_files):
+            num_file_messages = min(self.messages_per_file, self.num_messages - file_index * self.messages_per_file)
+            messages = []
+            for i in range(max(num_file_messages, 0)):
+                # Bursty conversations: mostly short gaps, sometimes long silences
+                timestamp += int(self.random.expovariate(1 / mean_gap_ms) * self.random.choice([0.1, 0.1, 0.5, 3.3]))
+                messages.append(self.__generate_message(timestamp))
+            messages.reverse()
+
+            filename = output_directory_path + OUTPUT_FILENAME_FORMAT.format(num_files - file_index)
+            with open(filename, "w") as output_file:
+                json.dump({
+                    PARTICIPANTS: [{PARTICIPANT_NAME: encode_like_facebook(p)} for p in self.participants],
+                    MESSAGES: messages,
+                    "title": "Synthetic group chat",
+                    "is_still_participant": True,
+                    "thread_type": "RegularGroup",
+                }, output_file, indent=2)
+
+
+    def __generate_message(self, timestamp):
+        sender = self.random.choices(self.participants, self.activity_weights)[0]
+        message = {SENDER_NAME: encode_like_facebook(sender), TIMESTAMP_MS: timestamp, MESSAGE_TYPE: "Generic"}
+
+        kind = self.random.random()
+        if kind < self.media_ratio:
+            media_field = self.random.choice(MEDIA_FIELDS)
+            message[media_field] = [{URI: "messages/photos/" + str(timestamp) + ".jpg"}]
+        elif kind < self.media_ratio + 0.01:
+            message[MESSAGE_TYPE] = "Call"
+            message[MESSAGE_CONTENT] = encode_like_facebook(sender + " joined the video chat.")
+        elif kind < self.media_ratio + 0.03:
+            message[MESSAGE_TYPE] = "Share"
+            message[MESSAGE_CONTENT] = encode_like_facebook(sender + " sent a link.")
+        else:
+            num_words = min(int(self.random.expovariate(1 / 7)) + 1, 60)
+            text = " ".join(self.random.choice(WORDS) for _ in range(num_words))
+            message[MESSAGE_CONTENT] = encode_like_facebook(text)
+
+        if self.random.random() < self.reaction_density:
+            num_reactions = min(int(self.random.expovariate(1 / 2)) + 1, self.num_participants)
+            favorite = self.random.choice(REACTIONS)
+            message[REACTIONS_FIELD] = [{
+                REACTION: encode_like_facebook(favorite if self.random.random() < 0.6 else self.random.choice(REACTIONS)),
+                ACTOR: encode_like_facebook(actor),
+            } for actor in self.random.sample(self.participants, num_reactions)]
+        return message
+
+
+    def __get_participant_names(self):
+        names = []
+        for i in range(self.num_participants):
+            name = FIRST_NAMES[i % len(FIRST_NAMES)] + " " + LAST_NAMES[(i // len(FIRST_NAMES) + i) % len(LAST_NAMES)]
+            if i >= len(FIRST_NAMES) * len(LAST_NAMES):
+                name += " " + str(i)
+            names.append(name)
+        return names
+
+
+# Facebook exports write the UTF-8 bytes of each string as separate latin1 characters
+def encode_like_facebook(text):
+    return text.encode("utf8").decode("latin1")
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+import io, json, os, random, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from parsers.JsonMessageParser import IncrementalJsonReader, MESSAGES
+
+
+DEFAULT_NUM_DOCUMENTS = 200
+MAX_DEPTH = 3
+
+
+"""
+Checks that IncrementalJsonReader decodes random documents exactly like json.loads
+with every chunk size from 1 character to the whole document, so that values cut
+off anywhere by a chunk boundary (mid-number, mid-literal, mid-escape...) are read
+correctly. Documents mix every JSON value type at the top level and inside the
+streamed `messages` array. Exits with an error on the first mismatch.
+
+Usage: benchmarks/json_chunk_fuzz.py [num_documents] [seed]
+"""
+def random_value(generator, depth=0):
+    kinds = ["int", "float", "string", "literal"] + (["list", "dict"] if depth < MAX_DEPTH else [])
+    kind = generator.choice(kinds)
+    if kind == "int":
+        return generator.randint(-10**6, 10**6)
+    if kind == "float":
+        return generator.choice([round(generator.uniform(-1000, 1000), generator.randint(0, 4)), \
+            generator.uniform(-1, 1) * 10 ** generator.randint(-30, 30)])
+    if kind == "string":
+        return "".join(generator.choice("ab \"\\/\n\té€😀") for i in range(generator.randint(0, 6)))
+    if kind == "literal":
+        return generator.choice([True, False, None])
+    if kind == "list":
+        return [random_value(generator, depth + 1) for i in range(generator.randint(0, 3))]
+    return {"k" + str(i): random_value(generator, depth + 1) for i in range(generator.randint(0, 3))}
+
+
+def random_document(generator):
+    fields = [("k" + str(i), random_value(generator)) for i in range(generator.randint(0, 3))]
+    fields.insert(generator.randint(0, len(fields)), \
+        (MESSAGES, [random_value(generator) for i in range(generator.randint(0, 4))]))
+    return json.dumps(dict(fields), indent=generator.choice([None, 1]), ensure_ascii=generator.random() < 0.5)
+
+
+def decode(text, chunk_size):
+    document = {}
+    json_file = io.StringIO(text)
+    json_file.name = "<fuzz>"
+    for key, value in IncrementalJsonReader(json_file, chunk_size).iterate_top_level(MESSAGES):
+        if key == MESSAGES:
+            document.setdefault(key, []).append(value)
+        else:
+            document[key] = value
+    document.setdefault(MESSAGES, [])
+    return document
+
+
+def main(num_documents, seed):
+    generator = random.Random(seed)
+    for i in range(num_documents):
+        text = random_document(generator)
+        expected = json.loads(text)
+        for chunk_size in range(1, len(text) + 1):
+            try:
+                matches = decode(text, chunk_size) == expected
+            except ValueError as error:
+                sys.exit(str(error) + " with chunk size " + str(chunk_size) + " on " + repr(text))
+            if not matches:
+                sys.exit("Mismatch with chunk size " + str(chunk_size) + " on " + repr(text))
+    print(str(num_documents) + " documents decoded identically with every chunk size")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_NUM_DOCUMENTS, \
+        int(sys.argv[2]) if len(sys.argv) > 2 else 0)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+import os, resource, subprocess, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from parsers.JsonMessageParser import JsonMessageParser
+
+
+DEFAULT_INPUT_DIRECTORY = "input/"
+MODES = ["eager", "compact", "streaming"]
+
+
+"""
+Compares the peak resident memory of parsing an export with `parse_message_data`,
+as message dicts ("eager") or as MessageRecords ("compact"), against
+`stream_messages`. Each mode runs in its own process so that the peaks don't
+contaminate each other.
+
+Usage: benchmarks/parser_memory.py [input_directory]
+"""
+def run_mode(mode, input_directory_path):
+    parser = JsonMessageParser(input_directory_path)
+    start = time.perf_counter()
+    if mode in ("eager", "compact"):
+        messages, participants = parser.parse_message_data(compact=mode == "compact")
+        num_messages = len(messages)
+    else:
+        num_messages = 0
+        for message in parser.stream_messages():
+            num_messages += 1
+    elapsed = time.perf_counter() - start
+
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+    print(mode + ": " + "{:,}".format(num_messages) + " messages in " + "{:.2f}".format(elapsed) \
+        + "s, peak RSS " + "{:,.1f}".format(peak_rss / 2**20) + " MiB")
+
+
+def main(input_directory_path):
+    for mode in MODES:
+        subprocess.run([sys.executable, __file__, input_directory_path, "--mode", mode], check=True)
+
+
+if __name__ == "__main__":
+    if "--mode" in sys.argv:
+        run_mode(sys.argv[sys.argv.index("--mode") + 1], sys.argv[1])
+    else:
+        main(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_INPUT_DIRECTORY)
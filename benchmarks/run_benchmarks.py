@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+import argparse, json, os, platform, resource, subprocess, sys, tempfile, time, tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+
+DEFAULT_SIZES = "10000,1000000,20000000"
+DEFAULT_DATA_DIRECTORY = "benchmarks/data/"
+INPUT_DIRECTORY = "input/"
+GENERATED_MARKER_FILENAME = ".complete"
+
+
+"""
+Times and memory-profiles each stage of the pipeline on synthetic exports of
+different sizes, and writes the results as JSON so runs can be compared over time.
+
+Each size runs in its own process, so `max_rss_bytes` (the process' peak resident
+memory so far) isn't inflated by earlier sizes. `peak_traced_bytes` is the peak
+memory allocated during the stage itself, as seen by tracemalloc.
+
+Usage: benchmarks/run_benchmarks.py [--sizes 10000,1000000] [--output results.json]
+"""
+def main():
+    arguments = parse_arguments()
+    if arguments.run_size is not None:
+        print(json.dumps(run_size(arguments.run_size, arguments)))
+        return
+
+    results = []
+    for size in [int(size) for size in arguments.sizes.split(",")]:
+        input_directory_path = generate_export(size, arguments)
+        print("Benchmarking " + "{:,}".format(size) + " messages...", file=sys.stderr)
+        command = [sys.executable, __file__, "--run-size", str(size)] + sys.argv[1:]
+        output = subprocess.run(command, check=True, stdout=subprocess.PIPE, text=True).stdout
+        results += json.loads(output)
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(report, output_file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic exports.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="comma-separated message counts")
+    parser.add_argument("--participants", type=int, default=8)
+    parser.add_argument("--years", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: CPU count)")
+    parser.add_argument("--data-directory", default=DEFAULT_DATA_DIRECTORY, \
+        help="where generated exports are kept between runs")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="skip tracemalloc, which slows down parsing")
+    parser.add_argument("--output", help="JSON file to write (default: stdout)")
+    parser.add_argument("--run-size", type=int, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+# Generated exports are reused across runs with the same settings
+def generate_export(size, arguments):
+    from benchmarks.SyntheticExportGenerator import SyntheticExportGenerator
+
+    export_directory_path = arguments.data_directory + "_".join(
+        [str(size), str(arguments.participants), str(arguments.years)]) + "/"
+    input_directory_path = export_directory_path + INPUT_DIRECTORY
+    marker_path = export_directory_path + GENERATED_MARKER_FILENAME
+    if not os.path.exists(marker_path):
+        print("Generating " + "{:,}".format(size) + " messages...", file=sys.stderr)
+        SyntheticExportGenerator(num_messages=size, num_participants=arguments.participants, \
+            num_years=arguments.years).generate(input_directory_path)
+        open(marker_path, "w").close()
+    return input_directory_path
+
+
+def run_size(size, arguments):
+    from parsers.JsonMessageParser import JsonMessageParser
+    from parsers.TimeIndex import TimeIndex
+    from messagestats.ReactionIndex import ReactionIndex
+    from messagestats.ActivityIndex import ActivityIndex
+    from messagestats.AggregatedMessageAnalyzer import AggregatedMessageAnalyzer
+    from messagestats.ConversationIndex import ConversationIndex
+    from messagestats.ConversationAnalyzer import ConversationAnalyzer, MS_PER_MINUTE
+    from graphers.BarGraphsGenerator import BarGraphsGenerator
+    from graphers.TimeSeriesGenerator import TimeSeriesGenerator
+    from graphers.ConversationGraphsGenerator import ConversationGraphsGenerator
+    from graphers.InteractionGraphsGenerator import InteractionGraphsGenerator
+    from wordclouds.TokenFrequencyCube import TokenFrequencyCube
+    from wordclouds.WordCloudGenerator import WordCloudGenerator
+    from main import SESSION_GAP_MINUTES
+
+    input_directory_path = generate_export(size, arguments)
+    output_directory_path = tempfile.mkdtemp(prefix="benchmark_output_") + "/"
+    results = []
+    def measure(stage, function, *args):
+        return measure_stage(results, size, stage, not arguments.no_tracemalloc, function, *args)
+
+    table, participants = measure("JsonMessageParser", \
+        JsonMessageParser(input_directory_path, num_workers=arguments.workers).parse_message_table)
+    time_index = measure("TimeIndex", TimeIndex, table.timestamps)
+    reaction_index = measure("ReactionIndex", ReactionIndex, table)
+    activity_index = measure("ActivityIndex", ActivityIndex, table, time_index)
+    conversation_index = measure("ConversationIndex", ConversationIndex, table, SESSION_GAP_MINUTES * MS_PER_MINUTE)
+    token_cube = measure("TokenFrequencyCube", TokenFrequencyCube.from_table, table, time_index)
+    measure("AggregatedMessageAnalyzer", AggregatedMessageAnalyzer(output_directory_path).generate_stats, \
+        table, participants, time_index, reaction_index, activity_index)
+    # Every run renders everything, so that the runs are comparable
+    measure("BarGraphsGenerator", BarGraphsGenerator(output_directory_path, skip_unchanged=False).generate_graphs, \
+        table, reaction_index, activity_index)
+    measure("TimeSeriesGenerator", TimeSeriesGenerator(output_directory_path, skip_unchanged=False).generate_graphs, \
+        table, time_index, activity_index)
+    measure("WordCloudGenerator", WordCloudGenerator(output_directory_path, skip_unchanged=False).generate_wordclouds, \
+        table, token_cube)
+    measure("ConversationAnalyzer", ConversationAnalyzer(output_directory_path).generate_stats, \
+        table, time_index, conversation_index)
+    measure("ConversationGraphsGenerator", \
+        ConversationGraphsGenerator(output_directory_path, skip_unchanged=False).generate_graphs, \
+        table, conversation_index)
+    measure("InteractionGraphsGenerator", \
+        InteractionGraphsGenerator(output_directory_path, skip_unchanged=False).generate_graphs, \
+        table, conversation_index, reaction_index)
+    return results
+
+
+def measure_stage(results, size, stage, use_tracemalloc, function, *args):
+    if use_tracemalloc:
+        tracemalloc.start()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    result = function(*args)
+    wall_seconds, cpu_seconds = time.perf_counter() - wall_start, time.process_time() - cpu_start
+    peak_traced_bytes = None
+    if use_tracemalloc:
+        peak_traced_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    # ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+    max_rss_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        max_rss_bytes *= 1024
+    results.append({
+        "messages": size,
+        "stage": stage,
+        "wall_seconds": round(wall_seconds, 4),
+        "cpu_seconds": round(cpu_seconds, 4),
+        "peak_traced_bytes": peak_traced_bytes,
+        "max_rss_bytes": max_rss_bytes,
+    })
+    print("  " + stage + ": " + "{:.2f}".format(wall_seconds) + "s", file=sys.stderr)
+    return result
+
+
+if __name__ == "__main__":
+    main()
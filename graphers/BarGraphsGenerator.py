@@ -1,13 +1,13 @@
-from datetime import datetime
-from collections import Counter
-import matplotlib.pyplot as plt
+from graphers.FigureRenderer import FigureRenderer, FigureTemplate, OUTPUT_FILE_FORMAT, format_count, \
+    format_percentage
+from pipeline.OutputManifest import OutputManifest, output_key
+from profiling.StageProfiler import profiled, instance_messages
 import numpy as np
 import unicodedata as ud
 import os
 
 
 OUTPUT_DIRECTORY = "graphs/"
-OUTPUT_FILE_FORMAT = ".png"
 TOP_REACTIONS_GRAPH_OUTPUT_FILENAME = "top_reactions_per_person.txt"
 
 # JSON field names
@@ -20,148 +20,141 @@ ACTOR = "actor"
 TOP_REACTIONS_PER_PERSON = 5
 BAR_GROUP_MARGIN = 0.2
 
+VOLUME_BAR_TEMPLATE = FigureTemplate(y_formatter=format_count)
+TOP_REACTIONS_TEMPLATE = FigureTemplate(size=(8, 4.5), y_formatter=format_percentage)
+
 
 class BarGraphsGenerator:
-    def __init__(self, output_directory_path):
+    # With `skip_unchanged`, graphs whose data hasn't changed since they were last
+    # rendered into `output_directory_path` are left as they are
+    def __init__(self, output_directory_path, skip_unchanged=True):
         self.output_directory_path = output_directory_path + OUTPUT_DIRECTORY
+        self.renderer = FigureRenderer(self.output_directory_path)
+        self.manifest = OutputManifest(output_directory_path, enabled=skip_unchanged)
         return
 
 
-    def generate_graphs(self, messages):
+    def generate_graphs(self, table, reaction_index, activity_index):
+        self.num_messages = len(table)
         if not os.path.exists(self.output_directory_path):
             os.makedirs(self.output_directory_path)
 
-        self.__plot_messages_per_person(messages)
-        self.__plot_reactions_per_person(messages)
-        self.__plot_top_reactions_per_person(messages)
+        self.__plot_messages_per_person(table, activity_index)
+        self.__plot_reactions_per_person(table, reaction_index)
+        self.__plot_top_reactions_per_person(table, reaction_index)
+        self.renderer.close()
+        self.manifest.write()
 
 
-    def __plot_messages_per_person(self, messages):
-        count_by_person = Counter([message[SENDER_NAME] for message in messages]).most_common()
-        self.__volume_bar_plot_helper("messages_per_person", count_by_person, len(messages), \
+    @profiled(count=instance_messages)
+    def __plot_messages_per_person(self, table, activity_index):
+        count_by_person = [(table.names[person], count) for person, count in activity_index.ranked_senders()]
+        self.__volume_bar_plot_helper("messages_per_person", count_by_person, len(table), \
             "Number of messages per person", "Number of Messages")
 
 
-    def __plot_reactions_per_person(self, messages):
-        reactions_per_person = self.__get_reactions_per_person(messages)
-        count_by_person = {}
-        for person in reactions_per_person:
-            count_by_person[person] = len(reactions_per_person[person])
-        count_by_person = Counter(count_by_person).most_common()
-        self.__volume_bar_plot_helper("reactions_per_person", count_by_person, len(messages), \
+    @profiled(count=instance_messages)
+    def __plot_reactions_per_person(self, table, reaction_index):
+        count_by_person = [(table.names[person], count) for person, count in reaction_index.ranked_actors()]
+        self.__volume_bar_plot_helper("reactions_per_person", count_by_person, len(table), \
             "Number of Reactions Given, by Person", "Number of Reactions Given")
 
 
-    def __get_reactions_per_person(self, messages):
-        reactions_by_person = {}
-        for message in messages:
-            if REACTIONS not in message:
-                continue
-            for reaction in message[REACTIONS]:
-                if ACTOR not in reaction or REACTION not in reaction:
-                    print("Unexpected error: Reaction JSON has no \"actor\" or \"reaction\" field!")
-                    continue
-                if reaction[ACTOR] not in reactions_by_person:
-                    reactions_by_person[reaction[ACTOR]] = []
-                reactions_by_person[reaction[ACTOR]].append(reaction[REACTION])
-        return reactions_by_person
-
-
     def __volume_bar_plot_helper(self, filename, count_by_person, total_count, title, y_label):
         x_labels = list([name for name, count in count_by_person])
         y_values = list([count for name, count in count_by_person])
         x_indices = np.arange(len(x_labels))
 
-        figure, axes = plt.subplots()
-        axes.spines["right"].set_visible(False)
-        axes.spines["top"].set_visible(False)
-        
-        axes.set_title(title)
-        axes.set_ylabel(y_label)
-        axes.set_xticks(x_indices)
-        axes.set_xticklabels(x_labels, rotation=75)
-
-        axes.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-        
-        rects = axes.bar(x_indices, y_values)
-        axes.bar(x_labels, y_values)
-        for rect in rects:
-            height = rect.get_height()
-            axes.annotate('{:,}'.format(height), \
-                xy=(rect.get_x() + rect.get_width() / 2, height), \
-                # vertical offset
-                xytext=(0, 3), \
-                textcoords="offset points", \
-                ha="center", va="bottom")
-            axes.annotate('{:.0%}'.format(height/total_count), \
-                xy=(rect.get_x() + rect.get_width() / 2, height), \
-                xytext=(0, 15), \
-                textcoords="offset points", \
-                color='b', \
-                ha="center", va="bottom")
-
-        figure.tight_layout()
-        plt.savefig(self.output_directory_path + filename + OUTPUT_FILE_FORMAT, \
-            format="png", bbox_inches="tight")
-
-
-    def __plot_top_reactions_per_person(self, messages):
-        reactions_per_person = self.__get_reactions_per_person(messages)
-        
-        top_reactions_per_person = {}
-        for person in reactions_per_person:
-            top_reactions_per_person[person] = Counter(reactions_per_person[person]).most_common()
-
-        x_labels = list(top_reactions_per_person.keys())
+        paths = [OUTPUT_DIRECTORY + filename + OUTPUT_FILE_FORMAT]
+        key = output_key(count_by_person, total_count, title, y_label, VOLUME_BAR_TEMPLATE)
+        if self.manifest.is_current(paths, key):
+            return
+
+        with self.renderer.axes(VOLUME_BAR_TEMPLATE, title, y_label) as axes:
+            axes.set_xticks(x_indices)
+            axes.set_xticklabels(x_labels, rotation=75)
+
+            # The bars used to be drawn twice, the second time in the second color of
+            # the cycle, which is the one they have always been seen in
+            rects = axes.bar(x_indices, y_values, color="C1")
+            for rect in rects:
+                height = rect.get_height()
+                axes.annotate('{:,}'.format(height), \
+                    xy=(rect.get_x() + rect.get_width() / 2, height), \
+                    # vertical offset
+                    xytext=(0, 3), \
+                    textcoords="offset points", \
+                    ha="center", va="bottom")
+                axes.annotate('{:.0%}'.format(height/total_count), \
+                    xy=(rect.get_x() + rect.get_width() / 2, height), \
+                    xytext=(0, 15), \
+                    textcoords="offset points", \
+                    color='b', \
+                    ha="center", va="bottom")
+
+            axes.figure.tight_layout()
+            self.renderer.save(axes, filename)
+        self.manifest.record(paths, key)
+
+
+    @profiled(count=instance_messages)
+    def __plot_top_reactions_per_person(self, table, reaction_index):
+        actors = {table.names[actor]: actor for actor, count in reaction_index.ranked_actors()}
+        x_labels = list(actors.keys())
         x_labels.sort()
 
         y_values, bar_reactions_per_person = [], []
         for person in x_labels:
-            reactions_counts = top_reactions_per_person[person]
-            bar_reactions_per_person.append([reaction.encode('latin1').decode('utf8') for reaction, count in reactions_counts])
+            reactions_counts = reaction_index.top_reactions(actors[person], TOP_REACTIONS_PER_PERSON)
+            bar_reactions_per_person.append([table.reactions[reaction] for reaction, count in reactions_counts])
 
             # normalize counts by person
-            total_reactions_per_person = np.array([count for reaction, count in reactions_counts])
-            y_values.append(total_reactions_per_person / sum(total_reactions_per_person))
+            top_reactions_counts = np.array([count for reaction, count in reactions_counts])
+            y_values.append(top_reactions_counts / reaction_index.reactions_given[actors[person]])
+
+            # people who used fewer distinct reactions get empty bars
+            missing_bars = max(TOP_REACTIONS_PER_PERSON - len(reactions_counts), 0)
+            bar_reactions_per_person[-1] += [""] * missing_bars
+            y_values[-1] = np.append(y_values[-1], np.zeros(missing_bars))
 
         bar_width = (1 - BAR_GROUP_MARGIN) / TOP_REACTIONS_PER_PERSON  # the width of each bar
         x_locations = [(np.arange(len(x_labels)) + x * bar_width) for x in range(TOP_REACTIONS_PER_PERSON)]  # the bar locations
 
-        fig, ax = plt.subplots()
-        fig.set_size_inches(8, 4.5)
-        ax.spines["right"].set_visible(False)
-        ax.spines["top"].set_visible(False)
-
-        ax.set_title("Top Reactions Given, by Person")
-        ax.set_ylabel("% of Reactions (per Person)")
-        ax.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:.0%}".format(x)))
-        ax.set_xticks(x_locations[0] + (1 - BAR_GROUP_MARGIN - bar_width) / 2)
-        ax.set_xticklabels(x_labels, rotation=75)
-
-        def replace_unsupported_emojis(emoji):
-            if emoji == '👍':
-                return 'U'
-            if emoji == '👎':
-                return 'D'
-            return emoji
-
-        for index in range(TOP_REACTIONS_PER_PERSON):
-            rects = ax.bar(x_locations[index], [reactions[index] for reactions in y_values], bar_width)
-            labels_per_bar = [replace_unsupported_emojis(person[index]) for person in bar_reactions_per_person]
-            for i, rect in enumerate(rects.get_children()):
-                height = rect.get_height()
-                ax.annotate(labels_per_bar[i], \
-                    xy=(rect.get_x() + rect.get_width() / 2, height), \
-                    xytext=(0, 3), \
-                    textcoords="offset points", \
-                    ha="center", va="bottom")
-
-        fig.tight_layout()
-        plt.savefig(self.output_directory_path + "top_reactions_per_person" + OUTPUT_FILE_FORMAT, \
-            format="png", bbox_inches="tight")
+        paths = [OUTPUT_DIRECTORY + "top_reactions_per_person" + OUTPUT_FILE_FORMAT, \
+            OUTPUT_DIRECTORY + TOP_REACTIONS_GRAPH_OUTPUT_FILENAME]
+        key = output_key(x_labels, bar_reactions_per_person, y_values, TOP_REACTIONS_TEMPLATE)
+        if self.manifest.is_current(paths, key):
+            return
+
+        with self.renderer.axes(TOP_REACTIONS_TEMPLATE, "Top Reactions Given, by Person", \
+                "% of Reactions (per Person)") as ax:
+            ax.set_xticks(x_locations[0] + (1 - BAR_GROUP_MARGIN - bar_width) / 2)
+            ax.set_xticklabels(x_labels, rotation=75)
+
+            def replace_unsupported_emojis(emoji):
+                if emoji == '👍':
+                    return 'U'
+                if emoji == '👎':
+                    return 'D'
+                return emoji
+
+            for index in range(TOP_REACTIONS_PER_PERSON):
+                rects = ax.bar(x_locations[index], [reactions[index] for reactions in y_values], bar_width)
+                labels_per_bar = [replace_unsupported_emojis(person[index]) for person in bar_reactions_per_person]
+                for i, rect in enumerate(rects.get_children()):
+                    height = rect.get_height()
+                    ax.annotate(labels_per_bar[i], \
+                        xy=(rect.get_x() + rect.get_width() / 2, height), \
+                        xytext=(0, 3), \
+                        textcoords="offset points", \
+                        ha="center", va="bottom")
+
+            ax.figure.tight_layout()
+            self.renderer.save(ax, "top_reactions_per_person")
 
         # Since reactions don't show up with the apple font in matplotlib, include the emojis in a file
         self.file = open(self.output_directory_path + TOP_REACTIONS_GRAPH_OUTPUT_FILENAME, "w")
         for i, person in enumerate(bar_reactions_per_person):
             self.file.write(x_labels[i] + ": " + str(person[:5]) + '\n')
         self.file.close()
+        self.manifest.record(paths, key)
@@ -0,0 +1,116 @@
+from graphers.FigureRenderer import FigureRenderer, FigureTemplate, OUTPUT_FILE_FORMAT, format_count
+from messagestats.ConversationAnalyzer import DURATION_BUCKET_MINUTES, REPLY_LATENCY_PERCENTILES, MS_PER_MINUTE, \
+    size_bucket_labels, duration_bucket_labels, percentile_label
+from pipeline.OutputManifest import OutputManifest, output_key
+from profiling.StageProfiler import profiled, instance_messages
+import numpy as np
+import os
+
+
+OUTPUT_DIRECTORY = "graphs/"
+BAR_GROUP_MARGIN = 0.2
+
+HISTOGRAM_TEMPLATE = FigureTemplate(y_formatter=format_count)
+PER_PERSON_TEMPLATE = FigureTemplate(size=(8, 4.5), y_formatter=format_count)
+REPLY_TIMES_TEMPLATE = FigureTemplate(size=(8, 4.5))
+
+
+"""
+Graphs of the conversations of the chat, from a ConversationIndex: histograms of
+their sizes and lengths, each person's reply times, and who starts and ends them.
+"""
+class ConversationGraphsGenerator:
+    # With `skip_unchanged`, graphs whose data hasn't changed since they were last
+    # rendered into `output_directory_path` are left as they are
+    def __init__(self, output_directory_path, skip_unchanged=True):
+        self.output_directory_path = output_directory_path + OUTPUT_DIRECTORY
+        self.renderer = FigureRenderer(self.output_directory_path)
+        self.manifest = OutputManifest(output_directory_path, enabled=skip_unchanged)
+        return
+
+
+    def generate_graphs(self, table, conversation_index):
+        self.num_messages = len(table)
+        if not os.path.exists(self.output_directory_path):
+            os.makedirs(self.output_directory_path)
+
+        self.__plot_conversation_sizes(conversation_index)
+        self.__plot_conversation_lengths(conversation_index)
+        self.__plot_reply_times_per_person(table, conversation_index)
+        self.__plot_conversation_starters(table, conversation_index)
+        self.renderer.close()
+        self.manifest.write()
+
+
+    @profiled(count=instance_messages)
+    def __plot_conversation_sizes(self, conversation_index):
+        histogram = conversation_index.size_histogram()
+        self.__histogram_plot_helper("conversation_sizes", size_bucket_labels(histogram), histogram, \
+            "Conversations by Number of Messages", "Number of Conversations")
+
+
+    @profiled(count=instance_messages)
+    def __plot_conversation_lengths(self, conversation_index):
+        histogram = conversation_index.duration_histogram(np.array(DURATION_BUCKET_MINUTES) * MS_PER_MINUTE)
+        self.__histogram_plot_helper("conversation_lengths", duration_bucket_labels(DURATION_BUCKET_MINUTES), \
+            histogram, "Conversations by Length", "Number of Conversations")
+
+
+    def __histogram_plot_helper(self, filename, x_labels, counts, title, y_label):
+        paths = [OUTPUT_DIRECTORY + filename + OUTPUT_FILE_FORMAT]
+        key = output_key(x_labels, counts, title, y_label, HISTOGRAM_TEMPLATE)
+        if self.manifest.is_current(paths, key):
+            return
+
+        x_indices = np.arange(len(x_labels))
+        with self.renderer.axes(HISTOGRAM_TEMPLATE, title, y_label) as axes:
+            axes.set_xticks(x_indices)
+            axes.set_xticklabels(x_labels, rotation=45)
+            axes.bar(x_indices, counts)
+
+            axes.figure.tight_layout()
+            self.renderer.save(axes, filename)
+        self.manifest.record(paths, key)
+
+
+    # One group of bars per person who replied, fastest median first
+    @profiled(count=instance_messages)
+    def __plot_reply_times_per_person(self, table, conversation_index):
+        percentiles = [conversation_index.reply_latency_percentiles(percentile) / MS_PER_MINUTE \
+            for percentile in REPLY_LATENCY_PERCENTILES]
+        people = [person for person in np.argsort(percentiles[0], kind="stable").tolist() \
+            if conversation_index.reply_counts[person] > 0]
+        self.__grouped_bar_plot_helper("reply_times_per_person", [table.names[person] for person in people], \
+            [values[people] for values in percentiles], \
+            [percentile_label(percentile).capitalize() for percentile in REPLY_LATENCY_PERCENTILES], \
+            REPLY_TIMES_TEMPLATE, "Reply Times, by Person", "Minutes")
+
+
+    @profiled(count=instance_messages)
+    def __plot_conversation_starters(self, table, conversation_index):
+        people = [person for person in np.argsort(-conversation_index.starter_counts, kind="stable").tolist() \
+            if conversation_index.starter_counts[person] + conversation_index.ender_counts[person] > 0]
+        self.__grouped_bar_plot_helper("conversation_starters", [table.names[person] for person in people], \
+            [conversation_index.starter_counts[people], conversation_index.ender_counts[people]], \
+            ["Started", "Ended"], PER_PERSON_TEMPLATE, "Conversations Started and Ended, by Person", \
+            "Number of Conversations")
+
+
+    def __grouped_bar_plot_helper(self, filename, x_labels, y_values, legend_labels, template, title, y_label):
+        paths = [OUTPUT_DIRECTORY + filename + OUTPUT_FILE_FORMAT]
+        key = output_key(x_labels, y_values, legend_labels, template, title, y_label)
+        if self.manifest.is_current(paths, key):
+            return
+
+        bar_width = (1 - BAR_GROUP_MARGIN) / len(y_values)
+        x_indices = np.arange(len(x_labels))
+        with self.renderer.axes(template, title, y_label) as axes:
+            axes.set_xticks(x_indices + (1 - BAR_GROUP_MARGIN - bar_width) / 2)
+            axes.set_xticklabels(x_labels, rotation=75)
+            for index, (values, label) in enumerate(zip(y_values, legend_labels)):
+                axes.bar(x_indices + index * bar_width, values, bar_width, label=label)
+            axes.legend()
+
+            axes.figure.tight_layout()
+            self.renderer.save(axes, filename)
+        self.manifest.record(paths, key)
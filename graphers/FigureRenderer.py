@@ -0,0 +1,81 @@
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import FuncFormatter
+from contextlib import contextmanager
+import matplotlib
+
+
+OUTPUT_FILE_FORMAT = ".png"
+
+
+"""
+Size and style shared by a family of charts: the figure size in inches (Matplotlib's
+default if None), no top and right spines, and an optional formatter for the y tick
+values.
+"""
+class FigureTemplate:
+    def __init__(self, size=None, y_formatter=None):
+        self.size = tuple(size if size is not None else matplotlib.rcParams["figure.figsize"])
+        self.y_formatter = y_formatter
+        return
+
+    def apply(self, axes, title, y_label):
+        axes.spines["right"].set_visible(False)
+        axes.spines["top"].set_visible(False)
+        axes.set_title(title)
+        axes.set_ylabel(y_label)
+        if self.y_formatter is not None:
+            axes.get_yaxis().set_major_formatter(FuncFormatter(lambda x, loc: self.y_formatter(x)))
+
+
+# Y tick formatters
+def format_count(x):
+    return "{:,}".format(int(x))
+
+def format_percentage(x):
+    return "{:.0%}".format(x)
+
+
+"""
+Draws charts on object-oriented Matplotlib Figures with their own Agg canvas, instead
+of pyplot, whose global figure registry keeps every figure alive until it is closed
+and can't be used from several threads.
+
+Figures are pooled by size: once a chart is saved, its figure is cleared and reused
+by the next chart of the same size, so memory stays the same however many charts are
+rendered. `close` drops the pool.
+"""
+class FigureRenderer:
+    def __init__(self, output_directory_path):
+        self.output_directory_path = output_directory_path
+        # Idle figures, by size
+        self.figures = {}
+        return
+
+
+    # Yields the axes of a blank figure styled by `template`. The figure goes back to
+    # the pool when the block exits, so the axes must not be used after that.
+    @contextmanager
+    def axes(self, template, title, y_label):
+        figure = self.figures.pop(template.size, None)
+        if figure is None:
+            figure = Figure(figsize=template.size)
+            FigureCanvasAgg(figure)
+        try:
+            axes = figure.subplots()
+            template.apply(axes, title, y_label)
+            yield axes
+        finally:
+            figure.clear()
+            figure.subplotpars.reset()
+            self.figures[template.size] = figure
+
+
+    # Saves the chart as it is now, so that it can be changed and saved again
+    def save(self, axes, filename):
+        axes.figure.savefig(self.output_directory_path + filename + OUTPUT_FILE_FORMAT, format="png", \
+            bbox_inches="tight")
+
+
+    def close(self):
+        self.figures.clear()
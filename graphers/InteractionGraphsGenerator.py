@@ -0,0 +1,94 @@
+from graphers.FigureRenderer import FigureRenderer, FigureTemplate, OUTPUT_FILE_FORMAT, format_count
+from pipeline.OutputManifest import OutputManifest, output_key
+from profiling.StageProfiler import profiled, instance_messages
+import numpy as np
+import csv, os
+
+
+OUTPUT_DIRECTORY = "graphs/"
+MATRIX_FILE_FORMAT = ".csv"
+# The heatmaps only show the people with the most interactions, so that their names
+# stay readable; the CSV files have everyone
+HEATMAP_MAX_PEOPLE = 25
+
+HEATMAP_TEMPLATE = FigureTemplate(size=(9, 8))
+
+
+"""
+Who talks to whom: heatmaps of how often each person replies to and reacts to each
+other person's messages, from the participants x participants matrices of a
+ConversationIndex and a ReactionIndex, along with the full matrices as CSV files.
+"""
+class InteractionGraphsGenerator:
+    # With `skip_unchanged`, outputs whose data hasn't changed since they were last
+    # written into `output_directory_path` are left as they are
+    def __init__(self, output_directory_path, skip_unchanged=True):
+        self.output_directory_path = output_directory_path + OUTPUT_DIRECTORY
+        self.renderer = FigureRenderer(self.output_directory_path)
+        self.manifest = OutputManifest(output_directory_path, enabled=skip_unchanged)
+        return
+
+
+    def generate_graphs(self, table, conversation_index, reaction_index):
+        self.num_messages = len(table)
+        if not os.path.exists(self.output_directory_path):
+            os.makedirs(self.output_directory_path)
+
+        self.__plot_replies_between_people(table, conversation_index)
+        self.__plot_reactions_between_people(table, reaction_index)
+        self.renderer.close()
+        self.manifest.write()
+
+
+    @profiled(count=instance_messages)
+    def __plot_replies_between_people(self, table, conversation_index):
+        self.__heatmap_plot_helper("replies_between_people", table.names, conversation_index.replier_sender_counts, \
+            "Replies, by Person", "Replied", "To a message by")
+
+
+    @profiled(count=instance_messages)
+    def __plot_reactions_between_people(self, table, reaction_index):
+        self.__heatmap_plot_helper("reactions_between_people", table.names, reaction_index.actor_sender_counts, \
+            "Reactions, by Person", "Reacted", "To a message by")
+
+
+    # `counts[row, column]` is how often the person `row` interacted with a message by
+    # the person `column`. People are ordered by their number of interactions, both
+    # given and received, and those without any are left out, as is the whole heatmap
+    # when nobody interacted.
+    def __heatmap_plot_helper(self, filename, names, counts, title, y_label, x_label):
+        totals = counts.sum(axis=0) + counts.sum(axis=1)
+        people = np.flatnonzero(totals)
+        # Nothing to show, e.g. a chat without reactions
+        if len(people) == 0:
+            return
+        people = people[np.argsort(-totals[people], kind="stable")]
+        labels = [str(names[person]) for person in people.tolist()]
+        counts = counts[np.ix_(people, people)]
+
+        paths = [OUTPUT_DIRECTORY + filename + OUTPUT_FILE_FORMAT, OUTPUT_DIRECTORY + filename + MATRIX_FILE_FORMAT]
+        key = output_key(labels, counts, title, y_label, x_label, HEATMAP_MAX_PEOPLE, HEATMAP_TEMPLATE)
+        if self.manifest.is_current(paths, key):
+            return
+
+        with open(self.output_directory_path + filename + MATRIX_FILE_FORMAT, "w", newline="") as matrix_file:
+            writer = csv.writer(matrix_file)
+            writer.writerow([y_label + " \\ " + x_label] + labels)
+            writer.writerows([label] + row for label, row in zip(labels, counts.tolist()))
+
+        shown = min(len(labels), HEATMAP_MAX_PEOPLE)
+        if shown < len(labels):
+            title += " (Top " + str(shown) + ")"
+        with self.renderer.axes(HEATMAP_TEMPLATE, title, y_label) as axes:
+            image = axes.imshow(counts[:shown, :shown], cmap="viridis", aspect="auto")
+            axes.set_xlabel(x_label)
+            axes.set_xticks(np.arange(shown))
+            axes.set_xticklabels(labels[:shown], rotation=75)
+            axes.set_yticks(np.arange(shown))
+            axes.set_yticklabels(labels[:shown])
+            colorbar = axes.figure.colorbar(image, ax=axes)
+            colorbar.ax.yaxis.set_major_formatter(lambda x, loc: format_count(x))
+
+            axes.figure.tight_layout()
+            self.renderer.save(axes, filename)
+        self.manifest.record(paths, key)
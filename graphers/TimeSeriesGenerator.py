@@ -1,136 +1,110 @@
-from datetime import datetime, date
-from dateutil.relativedelta import relativedelta
+from graphers.FigureRenderer import FigureRenderer, FigureTemplate, OUTPUT_FILE_FORMAT, format_count, \
+    format_percentage
 from matplotlib.patches import Ellipse
-import matplotlib.pyplot as plt
-from collections import Counter
+from pipeline.OutputManifest import OutputManifest, output_key
+from profiling.StageProfiler import profiled, instance_messages
 import numpy as np
 import os
 
 
 OUTPUT_DIRECTORY = "graphs/"
-OUTPUT_FILE_FORMAT = ".png"
 
 # JSON field names
 TIMESTAMP_MS = "timestamp_ms"
 SENDER_NAME = "sender_name"
 
+MESSAGE_VOLUME_TEMPLATE = FigureTemplate(size=(9, 4), y_formatter=format_count)
+PERSON_PERCENTAGE_TEMPLATE = FigureTemplate(size=(9.5, 4), y_formatter=format_percentage)
+
 
 class TimeSeriesGenerator:
-    def __init__(self, output_directory_path):
+    # With `skip_unchanged`, graphs whose data hasn't changed since they were last
+    # rendered into `output_directory_path` are left as they are
+    def __init__(self, output_directory_path, skip_unchanged=True):
         self.output_directory_path = output_directory_path + OUTPUT_DIRECTORY
+        self.renderer = FigureRenderer(self.output_directory_path)
+        self.manifest = OutputManifest(output_directory_path, enabled=skip_unchanged)
         return
 
 
-    def generate_graphs(self, messages):
+    def generate_graphs(self, table, time_index, activity_index):
+        self.num_messages = len(table)
+        # There's no month to plot
+        if len(table) == 0:
+            return
         if not os.path.exists(self.output_directory_path):
             os.makedirs(self.output_directory_path)
 
-        self.__plot_message_volume(messages)
-        self.__plot_person_percentage_volume(messages)
+        self.__plot_message_volume(time_index, activity_index)
+        self.__plot_person_percentage_volume(table, time_index, activity_index)
+        self.renderer.close()
+        self.manifest.write()
+
 
+    def __month_labels(self, time_index):
+        return [time_index.month_at(i).strftime("%B %Y") for i in range(time_index.num_months)]
 
-    def __plot_message_volume(self, messages):
-        def time_bucket(time):
-            # Hash together all messages in the same month
-            message_date = datetime.fromtimestamp(time/1000).date()
-            return date(year=message_date.year, month=message_date.month, day=1)
-        times = [time_bucket(m[TIMESTAMP_MS]) for m in messages]
-        counts = Counter(times).most_common()
-        
-        first_bucket, last_bucket = min(times), max(times)
-        def delta_months(month):
-            return (month.year - first_bucket.year) * 12 + (month.month - first_bucket.month)
-        num_month_buckets = delta_months(last_bucket) + 1
-        x_labels = [(first_bucket + relativedelta(months=i)).strftime("%B %Y") for i in range(num_month_buckets)]
 
+    @profiled(count=instance_messages)
+    def __plot_message_volume(self, time_index, activity_index):
+        num_month_buckets = time_index.num_months
+        x_labels = self.__month_labels(time_index)
         x_indices = range(num_month_buckets)
 
-        values = [0] * num_month_buckets
-        for month, count in counts:
-            index = delta_months(month)
-            values[index] = count
-
-        figure, axes = plt.subplots()
-        figure.set_size_inches(9, 4)
-        axes.spines["right"].set_visible(False)
-        axes.spines["top"].set_visible(False)
-        
-        axes.set_title("# of Messages Per Month")
-        axes.set_ylabel("Messages Per Month")
-        axes.set_xticks(x_indices)
-        axes.set_xticklabels(x_labels, rotation=90)
-
-        axes.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:,}".format(int(x))))
-
-        axes.plot(x_indices, values)
-
-        figure.tight_layout()
-        plt.savefig(self.output_directory_path + "messages_time_series" + OUTPUT_FILE_FORMAT, \
-            format="png", bbox_inches="tight")
-
-        # Add circles/annotations for the min and max months
-        most_count, least_count = counts[0], counts[-1]
-
-        def add_marker(date, value, color):
-            x_index = delta_months(date)
-            oval = Ellipse((x_index, value), 1, 400, color=color, fill=False)
-            axes.add_artist(oval)
-            axes.annotate('{:,}'.format(value), \
-                xy=(x_index, value), \
-                xytext=(0, 6), \
-                textcoords="offset points", \
-                color=color, \
-                ha="center", va="bottom")
-
-        add_marker(most_count[0], most_count[1], 'g')
-        add_marker(least_count[0], least_count[1], 'r')
-
-        plt.savefig(self.output_directory_path + "messages_time_series_min_max" + OUTPUT_FILE_FORMAT, \
-            format="png", bbox_inches="tight")
-
-
-    def __plot_person_percentage_volume(self, messages):
-        def time_bucket(time):
-            # Hash together all messages in the same month
-            message_date = datetime.fromtimestamp(time/1000).date()
-            return date(year=message_date.year, month=message_date.month, day=1)
-        times = [time_bucket(m[TIMESTAMP_MS]) for m in messages]
-        total_counts = Counter(times).most_common()
-        
-        first_bucket, last_bucket = min(times), max(times)
-        def delta_months(month):
-            return (month.year - first_bucket.year) * 12 + (month.month - first_bucket.month)
-        num_month_buckets = delta_months(last_bucket) + 1
+        values = activity_index.messages_per_month
+
+        paths = [OUTPUT_DIRECTORY + "messages_time_series" + OUTPUT_FILE_FORMAT, \
+            OUTPUT_DIRECTORY + "messages_time_series_min_max" + OUTPUT_FILE_FORMAT]
+        key = output_key(x_labels, values, MESSAGE_VOLUME_TEMPLATE)
+        if self.manifest.is_current(paths, key):
+            return
+
+        # Circles/annotations for the min and max months that had messages.
+        # Ties go to the earliest month for the max, and the latest one for the min.
+        months_with_messages = np.flatnonzero(values)
+        ranked_months = months_with_messages[np.argsort(-values[months_with_messages], kind="stable")]
+        most_count = (ranked_months[0], values[ranked_months[0]])
+        least_count = (ranked_months[-1], values[ranked_months[-1]])
+
+        with self.renderer.axes(MESSAGE_VOLUME_TEMPLATE, "# of Messages Per Month", "Messages Per Month") as axes:
+            axes.set_xticks(x_indices)
+            axes.set_xticklabels(x_labels, rotation=90)
+
+            axes.plot(x_indices, values)
+
+            axes.figure.tight_layout()
+            self.renderer.save(axes, "messages_time_series")
+
+            def add_marker(x_index, value, color):
+                oval = Ellipse((x_index, value), 1, 400, color=color, fill=False)
+                axes.add_artist(oval)
+                axes.annotate('{:,}'.format(value), \
+                    xy=(x_index, value), \
+                    xytext=(0, 6), \
+                    textcoords="offset points", \
+                    color=color, \
+                    ha="center", va="bottom")
+
+            add_marker(most_count[0], most_count[1], 'g')
+            add_marker(least_count[0], least_count[1], 'r')
+
+            self.renderer.save(axes, "messages_time_series_min_max")
+        self.manifest.record(paths, key)
+
+
+    @profiled(count=instance_messages)
+    def __plot_person_percentage_volume(self, table, time_index, activity_index):
+        num_month_buckets = time_index.num_months
         x_indices = range(num_month_buckets)
-        x_labels = [(first_bucket + relativedelta(months=i)).strftime("%B %Y") for i in range(num_month_buckets)]
+        x_labels = self.__month_labels(time_index)
 
         # Calculate the total count and per person, so we can get a ratio per person
-        times_and_sender = [(time_bucket(m[TIMESTAMP_MS]), m[SENDER_NAME]) for m in messages]
+        counts_per_month_and_person = activity_index.month_sender_counts
+        total_counts_per_month = activity_index.messages_per_month
 
-        total_counts_per_month = np.zeros(num_month_buckets)
         counts_per_person_per_month = {}
-        for month, person in times_and_sender:
-            if person not in counts_per_person_per_month:
-                counts_per_person_per_month[person] = np.zeros(num_month_buckets)
-            index = delta_months(month)
-            total_counts_per_month[index] += 1
-            counts_per_person_per_month[person][index] += 1
-
-        for person in counts_per_person_per_month:
-            counts_per_person_per_month[person] = counts_per_person_per_month[person] / total_counts_per_month
-
-        # Plot as filled-in area
-        figure, axes = plt.subplots()
-        figure.set_size_inches(9.5, 4)
-        axes.spines["right"].set_visible(False)
-        axes.spines["top"].set_visible(False)
-        
-        axes.set_title("% of Messages Per Month")
-        axes.set_ylabel("% of Messages Per Month")
-        axes.set_xticks(x_indices)
-        axes.set_xticklabels(x_labels, rotation=90)
-
-        axes.get_yaxis().set_major_formatter(plt.FuncFormatter(lambda x, loc: "{:.0%}".format(x)))
+        for person in activity_index.senders_in_order_of_appearance():
+            counts_per_person_per_month[table.names[person]] = counts_per_month_and_person[:, person] / total_counts_per_month
 
         y_values = []
         legend_labels = []
@@ -140,13 +114,24 @@ class TimeSeriesGenerator:
             name = person.split()
             legend_labels.append(" ".join([name[0], name[1][:1]]))
 
-        cumulative_sum = np.zeros(num_month_buckets)
-        for i in range(len(y_values) - 1):
-            cumulative_sum = cumulative_sum + y_values[i]
-            axes.fill_between(x_indices, cumulative_sum, cumulative_sum + y_values[i+1], label=legend_labels[i])
+        paths = [OUTPUT_DIRECTORY + "person_percentage_time_series" + OUTPUT_FILE_FORMAT]
+        key = output_key(x_labels, y_values, legend_labels, PERSON_PERCENTAGE_TEMPLATE)
+        if self.manifest.is_current(paths, key):
+            return
+
+        # Plot as filled-in area
+        with self.renderer.axes(PERSON_PERCENTAGE_TEMPLATE, "% of Messages Per Month", "% of Messages Per Month") \
+                as axes:
+            axes.set_xticks(x_indices)
+            axes.set_xticklabels(x_labels, rotation=90)
+
+            cumulative_sum = np.zeros(num_month_buckets)
+            for i in range(len(y_values) - 1):
+                cumulative_sum = cumulative_sum + y_values[i]
+                axes.fill_between(x_indices, cumulative_sum, cumulative_sum + y_values[i+1], label=legend_labels[i])
 
-        axes.legend(bbox_to_anchor=(1.15, 1.05))
+            axes.legend(bbox_to_anchor=(1.15, 1.05))
 
-        figure.tight_layout()
-        plt.savefig(self.output_directory_path + "person_percentage_time_series" + OUTPUT_FILE_FORMAT, \
-            format="png", bbox_inches="tight")
+            axes.figure.tight_layout()
+            self.renderer.save(axes, "person_percentage_time_series")
+        self.manifest.record(paths, key)
@@ -1,45 +1,419 @@
 #!/usr/bin/env python3
-from parsers.JsonMessageParser import JsonMessageParser
-from wordclouds.WordCloudGenerator import WordCloudGenerator
-from messagestats.AggregatedMessageAnalyzer import AggregatedMessageAnalyzer
-from graphers.BarGraphsGenerator import BarGraphsGenerator
-from graphers.TimeSeriesGenerator import TimeSeriesGenerator
-import os
+from pipeline.StageScheduler import Stage, StageScheduler, select_stages, initialize_worker
+from profiling.StageProfiler import PROFILER, CPROFILE_DIRECTORY
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta, timezone
+import argparse, contextlib, glob, io, json, os, sys, time
 # from IPython import embed; embed(); import sys; sys.exit(0) # For debugging
 
 
 # Input/output filepaths
 INPUT_DIRECTORY = "input/"
 OUTPUT_DIRECTORY = "output/"
+CACHE_DIRECTORY = "cache/"
+INBOX_INDEX_FILENAME = "index.json"
+
+# IANA timezone used to bucket messages into days, e.g. "America/Los_Angeles".
+# None uses the system's local timezone.
+TIMEZONE = None
+
+# Messages more than this many minutes apart are in separate conversations
+SESSION_GAP_MINUTES = 60
+
+# Outputs that can be picked with --only, and the stage that generates each
+OUTPUT_STAGES = {
+    "stats": "Generating statistics",
+    "bars": "Generating bar graphs",
+    "timeseries": "Generating time series graphs",
+    "wordclouds": "Generating word clouds",
+    "conversations": "Analyzing conversations",
+    "interactions": "Analyzing interactions",
+    "store": "Storing messages",
+}
+# The SQLite store is only built when asked for
+DEFAULT_OUTPUTS = ["stats", "bars", "timeseries", "wordclouds", "conversations", "interactions"]
+STORE_FILENAME = "messages.sqlite"
+
+
+"""
+Raised when `since` and `until` leave no messages to analyze.
+"""
+class NoMessagesError(ValueError):
+    pass
 
 
 class GroupchatAnalyzer:
-    def __init__(self):
+    # `cache_directory_path=None` disables the parse cache, and `num_workers` defaults
+    # to the number of CPUs. `since` and `until` are dates that limit the analysis to
+    # the messages sent on those days and the days in between. `session_gap_minutes` is
+    # the idle time that ends a conversation.
+    def __init__(self, input_directory_path=INPUT_DIRECTORY, output_directory_path=OUTPUT_DIRECTORY, \
+            cache_directory_path=CACHE_DIRECTORY, timezone=TIMEZONE, num_workers=None, since=None, until=None, \
+            session_gap_minutes=SESSION_GAP_MINUTES):
+        self.settings = {
+            "input_directory_path": input_directory_path,
+            "output_directory_path": output_directory_path,
+            "cache_directory_path": cache_directory_path,
+            "timezone": timezone,
+            "num_workers": num_workers,
+            "since": since,
+            "until": until,
+            "session_gap_minutes": session_gap_minutes,
+        }
         return
 
-    def run_main(self):
-        if not os.path.exists(OUTPUT_DIRECTORY):
-            os.makedirs(OUTPUT_DIRECTORY)
+    # `outputs` are keys of OUTPUT_STAGES; only the stages they need are run. `profile`
+    # writes the time and memory used by each stage and step to profile.json, and
+    # `cprofile` also dumps a cProfile of each stage.
+    def run_main(self, outputs=tuple(DEFAULT_OUTPUTS), profile=False, cprofile=False):
+        output_directory_path = self.settings["output_directory_path"]
+        if not os.path.exists(output_directory_path):
+            os.makedirs(output_directory_path)
+        if profile or cprofile:
+            PROFILER.enable(output_directory_path + CPROFILE_DIRECTORY if cprofile else None)
 
-        print("Parsing messages...")
-        self.messages, self.participants = JsonMessageParser(INPUT_DIRECTORY).parse_message_data()
+        # The output stages don't depend on each other, so they run concurrently
+        stages = select_stages(get_stages(), [OUTPUT_STAGES[output] for output in outputs])
+        self.data = StageScheduler(stages, self.settings["num_workers"]).run({"settings": self.settings})
 
-        print("Generating statistics...")
-        AggregatedMessageAnalyzer(OUTPUT_DIRECTORY).generate_stats(self.messages, self.participants)
+        if PROFILER.enabled:
+            self.__print_profile(PROFILER.write_report(output_directory_path))
+        print("Done!")
 
-        print("Generating bar graphs...")
-        BarGraphsGenerator(OUTPUT_DIRECTORY).generate_graphs(self.messages)
+    def __print_profile(self, records):
+        print("Profile:")
+        for record in records:
+            if record["parent"] is None:
+                print("  " + record["name"] + ": " + "{:.2f}".format(record["wall_seconds"]) + "s wall, " \
+                    + "{:.2f}".format(record["cpu_seconds"]) + "s CPU, " \
+                    + "{:.1f}".format(record["peak_traced_bytes"] / 1024 / 1024) + " MB peak")
 
-        print("Generating time series graphs...")
-        TimeSeriesGenerator(OUTPUT_DIRECTORY).generate_graphs(self.messages)
 
-        print("Generating word clouds...")
-        WordCloudGenerator(OUTPUT_DIRECTORY).generate_wordclouds(self.messages)
+"""
+Batch mode for a whole Messenger export: every subdirectory of the inbox that holds
+JSON files is analyzed as its own chat, with outputs in a subdirectory of the same
+name. Threads are analyzed concurrently, one per worker process, and a thread that
+fails is recorded in the index instead of stopping the others.
 
-        print("Done!")
+A worker process that dies (e.g. killed for running out of memory) breaks the whole
+pool, failing every thread that hadn't finished. Those threads are then analyzed
+again, each in a process of its own, so that only the one that kills its process
+is recorded as failed.
+"""
+class InboxAnalyzer:
+    # `num_workers` defaults to the number of CPUs
+    def __init__(self, inbox_directory_path, output_directory_path=OUTPUT_DIRECTORY, \
+            cache_directory_path=CACHE_DIRECTORY, timezone=TIMEZONE, num_workers=None, since=None, until=None, \
+            session_gap_minutes=SESSION_GAP_MINUTES):
+        self.inbox_directory_path = inbox_directory_path
+        self.output_directory_path = output_directory_path
+        self.cache_directory_path = cache_directory_path
+        self.timezone = timezone
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.since = since
+        self.until = until
+        self.session_gap_minutes = session_gap_minutes
+        return
+
+    # Writes a summary of every thread to index.json and returns it
+    def run_main(self, outputs=tuple(DEFAULT_OUTPUTS)):
+        threads = self.__get_threads()
+        if not os.path.exists(self.output_directory_path):
+            os.makedirs(self.output_directory_path)
+
+        # Threads are the unit of parallelism, so each is analyzed in a single process
+        thread_workers = self.num_workers if len(threads) <= 1 else 1
+        settings = [{
+            "input_directory_path": self.inbox_directory_path + thread + "/",
+            "output_directory_path": self.output_directory_path + thread + "/",
+            "cache_directory_path": self.cache_directory_path + thread + "/" if self.cache_directory_path else None,
+            "timezone": self.timezone,
+            "num_workers": thread_workers,
+            "since": self.since,
+            "until": self.until,
+            "session_gap_minutes": self.session_gap_minutes,
+        } for thread in threads]
+        settings = dict(zip(threads, settings))
+
+        summaries = {}
+        unfinished = []
+        with ProcessPoolExecutor(min(self.num_workers, max(len(threads), 1)), initializer=initialize_worker, \
+                initargs=(PROFILER.settings(),)) as pool:
+            futures = {pool.submit(analyze_thread, settings[thread], outputs): thread for thread in threads}
+            for future in as_completed(futures):
+                if isinstance(future.exception(), BrokenProcessPool):
+                    unfinished.append(futures[future])
+                else:
+                    self.__record_summary(summaries, futures[future], future)
+        if unfinished:
+            self.__run_isolated(sorted(unfinished), settings, outputs, summaries)
+
+        index = {
+            "threads": [summaries[thread] for thread in threads],
+            "num_threads": len(threads),
+            "num_failed": sum(summary["status"] != "ok" for summary in summaries.values()),
+            "num_messages": sum(summary.get("messages", 0) for summary in summaries.values()),
+        }
+        with open(self.output_directory_path + INBOX_INDEX_FILENAME, "w") as index_file:
+            json.dump(index, index_file, indent=2, ensure_ascii=False)
+        print("Done! " + str(len(threads) - index["num_failed"]) + " of " + str(len(threads)) + " threads analyzed")
+        return index
+
+    # Analyzes each of `threads` in a single-worker pool of its own, `num_workers` at a
+    # time, so that a worker process that dies only fails its own thread
+    def __run_isolated(self, threads, settings, outputs, summaries):
+        waiting, running = list(threads), {}
+        while waiting or running:
+            while waiting and len(running) < self.num_workers:
+                thread = waiting.pop(0)
+                pool = ProcessPoolExecutor(1, initializer=initialize_worker, initargs=(PROFILER.settings(),))
+                running[pool.submit(analyze_thread, settings[thread], outputs)] = (thread, pool)
+            done, not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                thread, pool = running.pop(future)
+                pool.shutdown()
+                self.__record_summary(summaries, thread, future)
+
+    def __record_summary(self, summaries, thread, future):
+        try:
+            summary = future.result()
+        except Exception as error:
+            # e.g. the worker process was killed
+            summary = {"status": "error", "error": type(error).__name__ + ": " + str(error)}
+        summaries[thread] = dict(thread=thread, **summary)
+        print(("Analyzed " if summary["status"] == "ok" else "Failed to analyze ") + thread \
+            + (": " + summary["error"] if summary["status"] != "ok" else ""))
+
+    def __get_threads(self):
+        from parsers.JsonMessageParser import INPUT_FILENAMES_REGEX
+        return sorted(entry.name for entry in os.scandir(self.inbox_directory_path) \
+            if entry.is_dir() and glob.glob(os.path.join(glob.escape(entry.path), INPUT_FILENAMES_REGEX)))
+
+
+# Runs in a worker process: analyzes one thread of an inbox and summarizes it
+def analyze_thread(settings, outputs):
+    start = time.perf_counter()
+    try:
+        # The stages' progress messages would interleave with the other threads'
+        with contextlib.redirect_stdout(io.StringIO()):
+            analyzer = GroupchatAnalyzer(**settings)
+            analyzer.run_main(outputs=outputs)
+    except Exception as error:
+        return {"status": "error", "error": type(error).__name__ + ": " + str(error)}
+
+    table = analyzer.data["table"]
+    return {
+        "status": "ok",
+        "output_directory": settings["output_directory_path"],
+        "messages": len(table),
+        "participants": sorted(analyzer.data["participants"]),
+        "first_message": utc_iso_date(table.timestamps.min()) if len(table) else None,
+        "last_message": utc_iso_date(table.timestamps.max()) if len(table) else None,
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def utc_iso_date(timestamp_ms):
+    return datetime.fromtimestamp(int(timestamp_ms) / 1000, timezone.utc).isoformat()
+
+
+def get_stages():
+    return [
+        Stage("Parsing messages", parse_messages, requires=["settings"], produces=["table", "participants"], \
+            parallel=False),
+        Stage("Indexing timestamps", index_timestamps, requires=["settings", "table"], produces=["time_index"], \
+            parallel=False),
+        Stage("Indexing reactions", index_reactions, requires=["table"], produces=["reaction_index"], \
+            parallel=False),
+        Stage("Indexing activity", index_activity, requires=["table", "time_index"], produces=["activity_index"], \
+            parallel=False),
+        Stage("Segmenting conversations", index_conversations, requires=["settings", "table"], \
+            produces=["conversation_index"], parallel=False),
+        Stage("Generating statistics", generate_statistics, \
+            requires=["settings", "table", "participants", "time_index", "reaction_index", "activity_index"]),
+        Stage("Generating bar graphs", generate_bar_graphs, \
+            requires=["settings", "table", "reaction_index", "activity_index"]),
+        Stage("Generating time series graphs", generate_time_series_graphs, \
+            requires=["settings", "table", "time_index", "activity_index"]),
+        Stage("Generating word clouds", generate_wordclouds, requires=["settings", "table", "time_index"]),
+        Stage("Analyzing conversations", analyze_conversations, \
+            requires=["settings", "table", "time_index", "conversation_index"]),
+        Stage("Analyzing interactions", analyze_interactions, \
+            requires=["settings", "table", "conversation_index", "reaction_index"]),
+        Stage("Storing messages", store_messages, requires=["settings", "table", "participants", "time_index"]),
+    ]
+
+
+# Pipeline stages. Each imports its modules when it runs, so that e.g. a statistics-only
+# run never loads matplotlib or wordcloud.
+def parse_messages(settings):
+    from parsers.JsonMessageParser import JsonMessageParser
+    table, participants = JsonMessageParser(settings["input_directory_path"], num_workers=settings["num_workers"], \
+        cache_directory_path=settings["cache_directory_path"]).parse_message_table()
+    if settings["since"] is not None or settings["until"] is not None:
+        from parsers.TimeIndex import day_start_ms
+        since, until = settings["since"], settings["until"]
+        table = table.time_range(
+            day_start_ms(since, settings["timezone"]) if since is not None else None,
+            day_start_ms(until + timedelta(days=1), settings["timezone"]) if until is not None else None)
+        if len(table) == 0:
+            raise NoMessagesError("no messages were sent" + (" on or after " + str(since) if since else "") \
+                + (" and" if since and until else "") + (" on or before " + str(until) if until else ""))
+    return {"table": table, "participants": participants}
+
+def index_timestamps(settings, table):
+    from parsers.TimeIndex import TimeIndex
+    return {"time_index": TimeIndex(table.timestamps, settings["timezone"])}
+
+def index_reactions(table):
+    from messagestats.ReactionIndex import ReactionIndex
+    return {"reaction_index": ReactionIndex(table)}
+
+def index_activity(table, time_index):
+    from messagestats.ActivityIndex import ActivityIndex
+    return {"activity_index": ActivityIndex(table, time_index)}
+
+def index_conversations(settings, table):
+    from messagestats.ConversationIndex import ConversationIndex
+    from messagestats.ConversationAnalyzer import MS_PER_MINUTE
+    return {"conversation_index": ConversationIndex(table, int(settings["session_gap_minutes"] * MS_PER_MINUTE))}
+
+def generate_statistics(settings, table, participants, time_index, reaction_index, activity_index):
+    from messagestats.AggregatedMessageAnalyzer import AggregatedMessageAnalyzer
+    state = incremental_state(settings, "statistics", [settings["timezone"], sorted(participants)])
+    AggregatedMessageAnalyzer(settings["output_directory_path"], num_workers=settings["num_workers"]) \
+        .generate_stats(table, participants, time_index, reaction_index, activity_index, state)
+
+# Without a cache, every graph and word cloud is rendered again too
+def generate_bar_graphs(settings, table, reaction_index, activity_index):
+    from graphers.BarGraphsGenerator import BarGraphsGenerator
+    BarGraphsGenerator(settings["output_directory_path"], skip_unchanged=settings["cache_directory_path"] is not None) \
+        .generate_graphs(table, reaction_index, activity_index)
+
+def generate_time_series_graphs(settings, table, time_index, activity_index):
+    from graphers.TimeSeriesGenerator import TimeSeriesGenerator
+    TimeSeriesGenerator(settings["output_directory_path"], skip_unchanged=settings["cache_directory_path"] is not None) \
+        .generate_graphs(table, time_index, activity_index)
+
+# Words are counted here rather than in a stage of their own, so that counting them
+# runs alongside the other outputs
+def generate_wordclouds(settings, table, time_index):
+    from wordclouds.TokenFrequencyCube import TokenFrequencyCube
+    from wordclouds.WordCloudGenerator import WordCloudGenerator
+    def count(start):
+        return TokenFrequencyCube.from_table(table, time_index, start)
+    state = incremental_state(settings, "token_cube", [settings["timezone"]])
+    token_cube = state.update(table, count, TokenFrequencyCube.merge) if state is not None else count(0)
+    WordCloudGenerator(settings["output_directory_path"], skip_unchanged=settings["cache_directory_path"] is not None) \
+        .generate_wordclouds(table, token_cube)
+
+def analyze_conversations(settings, table, time_index, conversation_index):
+    from messagestats.ConversationAnalyzer import ConversationAnalyzer
+    from graphers.ConversationGraphsGenerator import ConversationGraphsGenerator
+    ConversationAnalyzer(settings["output_directory_path"]).generate_stats(table, time_index, conversation_index)
+    ConversationGraphsGenerator(settings["output_directory_path"], \
+        skip_unchanged=settings["cache_directory_path"] is not None).generate_graphs(table, conversation_index)
+
+def analyze_interactions(settings, table, conversation_index, reaction_index):
+    from graphers.InteractionGraphsGenerator import InteractionGraphsGenerator
+    InteractionGraphsGenerator(settings["output_directory_path"], \
+        skip_unchanged=settings["cache_directory_path"] is not None) \
+        .generate_graphs(table, conversation_index, reaction_index)
+
+
+# Saved analysis of the messages seen by the previous runs, so that only new messages
+# are analyzed, or None without a cache. `key` is what else the analysis depends on.
+# Runs limited by `since` or `until` don't use it, so that they leave the state of the
+# whole history to the next full run.
+def incremental_state(settings, name, key):
+    from pipeline.IncrementalState import IncrementalState
+    if settings["cache_directory_path"] is None or settings["since"] is not None or settings["until"] is not None:
+        return None
+    return IncrementalState(settings["cache_directory_path"], name, key)
+
+def store_messages(settings, table, participants, time_index):
+    from parsers.MessageStore import MessageStore
+    store = MessageStore(settings["output_directory_path"] + STORE_FILENAME)
+    store.load(table, participants, time_index)
+    store.close()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Analyze a Facebook Messenger group chat export.")
+    parser.add_argument("--only", default=",".join(DEFAULT_OUTPUTS), \
+        help="comma-separated outputs to generate, out of " + ", ".join(OUTPUT_STAGES) + " (default: " \
+        + ",".join(DEFAULT_OUTPUTS) + "; store writes a SQLite database of the messages to <output>/" \
+        + STORE_FILENAME + ")")
+    parser.add_argument("--input", default=INPUT_DIRECTORY, help="directory of the exported JSON files")
+    parser.add_argument("--inbox", help="analyze every thread directory in this directory (e.g. an export's " \
+        + "messages/inbox/), each into its own output directory, and write a summary to <output>/" \
+        + INBOX_INDEX_FILENAME)
+    parser.add_argument("--output", default=OUTPUT_DIRECTORY, help="directory to write the outputs to")
+    parser.add_argument("--cache", default=CACHE_DIRECTORY, help="directory of the parse cache")
+    parser.add_argument("--no-cache", action="store_true", \
+        help="parse every input file again, and render every graph and word cloud again")
+    parser.add_argument("--timezone", default=TIMEZONE, \
+        help="IANA timezone used to bucket messages into days (default: local time)")
+    parser.add_argument("--since", type=date.fromisoformat, \
+        help="only analyze messages sent on or after this date (YYYY-MM-DD)")
+    parser.add_argument("--until", type=date.fromisoformat, \
+        help="only analyze messages sent on or before this date (YYYY-MM-DD)")
+    parser.add_argument("--session-gap", type=float, default=SESSION_GAP_MINUTES, \
+        help="minutes without messages that end a conversation (default: " + str(SESSION_GAP_MINUTES) + ")")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--profile", action="store_true", \
+        help="write the time and memory used by each stage to <output>/profile.json")
+    parser.add_argument("--cprofile", action="store_true", \
+        help="also dump a cProfile of each stage to <output>/" + CPROFILE_DIRECTORY)
+    arguments = parser.parse_args()
+
+    arguments.only = [output.strip() for output in arguments.only.split(",") if output.strip()]
+    unknown = [output for output in arguments.only if output not in OUTPUT_STAGES]
+    if unknown:
+        parser.error("unknown output " + ", ".join(unknown) + "; choose from " + ", ".join(OUTPUT_STAGES))
+    if arguments.workers is not None and arguments.workers < 1:
+        parser.error("--workers must be at least 1")
+    if arguments.since and arguments.until and arguments.since > arguments.until:
+        parser.error("--since must not be after --until")
+    if arguments.session_gap <= 0:
+        parser.error("--session-gap must be positive")
+    if arguments.inbox and (arguments.profile or arguments.cprofile):
+        parser.error("--profile and --cprofile are not supported with --inbox")
+    return arguments
+
+
+# Paths are used as prefixes, so they need a trailing slash
+def directory_path(path):
+    return os.path.join(path, "")
 
 
 
 # Main
 if __name__ == "__main__":
-    GroupchatAnalyzer().run_main()
+    arguments = parse_arguments()
+    if arguments.inbox:
+        InboxAnalyzer(
+            directory_path(arguments.inbox),
+            output_directory_path=directory_path(arguments.output),
+            cache_directory_path=None if arguments.no_cache else directory_path(arguments.cache),
+            timezone=arguments.timezone,
+            num_workers=arguments.workers,
+            since=arguments.since,
+            until=arguments.until,
+            session_gap_minutes=arguments.session_gap,
+        ).run_main(outputs=arguments.only)
+    else:
+        try:
+            GroupchatAnalyzer(
+                input_directory_path=directory_path(arguments.input),
+                output_directory_path=directory_path(arguments.output),
+                cache_directory_path=None if arguments.no_cache else directory_path(arguments.cache),
+                timezone=arguments.timezone,
+                num_workers=arguments.workers,
+                since=arguments.since,
+                until=arguments.until,
+                session_gap_minutes=arguments.session_gap,
+            ).run_main(outputs=arguments.only, profile=arguments.profile, cprofile=arguments.cprofile)
+        except NoMessagesError as error:
+            sys.exit("error: " + str(error))
@@ -1,5 +1,7 @@
-from datetime import datetime
-from collections import Counter
+from messagestats.StatisticsAggregates import StatisticsAggregate, aggregate_statistics, MISSING
+from parsers.MessageTable import ranked_counts
+from profiling.StageProfiler import profiled, instance_messages
+import numpy as np
 import os
 
 
@@ -23,41 +25,61 @@ NUM_TOP_DATES_TO_PUBLISH = 5
 
 
 """
-Outputs a txt file with different stats on each line
+Outputs a txt file with different stats on each line. The stats are computed as
+mergeable aggregates (see StatisticsAggregates), sharded across `num_workers`
+processes for large chats. With an IncrementalState, the aggregates are saved and
+later runs only aggregate the messages added since.
 """
 class AggregatedMessageAnalyzer:
-    def __init__(self, output_directory_path):
+    # `num_workers` defaults to the number of CPUs
+    def __init__(self, output_directory_path, num_workers=None):
         self.output_directory_path = output_directory_path + OUTPUT_DIRECTORY
         self.output_file_path = self.output_directory_path + OUTPUT_FILENAME
+        self.num_workers = num_workers
         return
 
 
-    def generate_stats(self, messages, participants):
+    def generate_stats(self, table, participants, time_index, reaction_index, activity_index, state=None):
+        self.num_messages = len(table)
         if not os.path.exists(self.output_directory_path):
             os.makedirs(self.output_directory_path)
+
+        # The indexes cover the whole table, so they are only reused when aggregating all of it
+        def aggregate(start):
+            if start == 0:
+                return aggregate_statistics(table, participants, time_index.days, reaction_index, activity_index, \
+                    self.num_workers)
+            return aggregate_statistics(table.slice(start, len(table)), participants, time_index.days[start:], \
+                num_workers=self.num_workers)
+        statistics = state.update(table, aggregate, StatisticsAggregate.merge) if state is not None else aggregate(0)
         self.file = open(self.output_file_path, "w")
 
-        self.__publish_totals(messages, participants)
-        self.__publish_messages_per_day(messages)
-        self.__publish_top_reacted_messages(messages, participants)
+        num_participants = len(statistics.totals.participants)
+        self.__publish_totals(statistics.totals)
+        if statistics.totals.num_messages == 0:
+            self.file.close()
+            return
+        self.__publish_messages_per_day(statistics.daily_activity)
+        self.__publish_top_reacted_messages(table.names, statistics.reacted_messages, num_participants)
+        self.__publish_reactions_to_senders(table.names, statistics.reactions_to_senders)
 
         self.file.close()
 
 
-    def __publish_totals(self, messages, participants):
-        self.__write_data(str(len(messages)) + " messages")
-        self.__write_data(str(len(participants)) + " participants")
-
+    @profiled(count=instance_messages)
+    def __publish_totals(self, totals):
+        self.__write_data(str(totals.num_messages) + " messages")
+        self.__write_data(str(len(totals.participants)) + " participants")
 
-    def __publish_messages_per_day(self, messages):
-        message_dates = [datetime.fromtimestamp(m[TIMESTAMP_MS]/1000).date() for m in messages]
 
-        num_total_messages = len(messages)
-        num_dates_with_messages = len(set(message_dates))
+    @profiled(count=instance_messages)
+    def __publish_messages_per_day(self, daily_activity):
+        counts = daily_activity.counts
 
-        earliest_date = min(message_dates)
-        latest_date = max(message_dates)
-        num_total_days = (latest_date - earliest_date).days
+        num_total_messages = daily_activity.num_messages
+        num_dates_with_messages = np.count_nonzero(counts)
+        # Days since the first one, but at least 1 when every message is on the same day
+        num_total_days = max(len(counts) - 1, 1)
 
         self.__write_data("Total number of days: " + str(num_total_days))
         self.__write_data("Days with messages: " + str(num_dates_with_messages))
@@ -70,110 +92,115 @@ class AggregatedMessageAnalyzer:
         self.__write_data("% of days that had no messages, since our first message: " \
             + round((1 - num_dates_with_messages/num_total_days)*100) + "%")
 
-        # Get the days with the highest number of messages
-        counts = Counter(message_dates)
-        most_active_dates = counts.most_common(NUM_TOP_DATES_TO_PUBLISH)
+        # Get the days with the highest number of messages. Messages are in chronological
+        # order, so ties go to the earliest day.
+        most_active_days = np.argsort(-counts, kind="stable")[:NUM_TOP_DATES_TO_PUBLISH]
         self.__write_data("\nDates with the most messages:")
-        for i in range(len(most_active_dates)):
-            self.__write_data(str(i + 1) + ". " + most_active_dates[i][0].strftime("%B %d, %Y") \
-                + ": " + str(most_active_dates[i][1]) + " messages")
+        for i, day in enumerate(most_active_days.tolist()):
+            self.__write_data(str(i + 1) + ". " + daily_activity.day_at(day).strftime("%B %d, %Y") \
+                + ": " + str(counts[day]) + " messages")
 
         # Get a sample message from the top day, so we can search for the date in the chat history afterward
-        top_active_date = most_active_dates[0][0]
-        message_from_top_active_date = messages[message_dates.index(top_active_date)]
+        message_from_top_active_date = daily_activity.first_text(most_active_days[0]) or ""
         self.__write_data("\nSample message from the most active date: \"" \
-            + message_from_top_active_date[MESSAGE_CONTENT] + "\"\n\n")
+            + message_from_top_active_date + "\"\n\n")
 
 
-    def __publish_top_reacted_messages(self, messages, participants):
-        num_participants = len(participants)
-        top_reacted_messages = {}
-        for message in messages:
-            if REACTIONS not in message:
-                continue
-            num_reactions = len(message[REACTIONS])
-            # Assumming people don't react to their own messages, the most reactions
-            # you can expect is `len(participants) - 1`. This gets all messages that
-            # have that maximum, or almost had the maximum.
-            if num_reactions < num_participants - 2:
-                continue
-            if num_reactions not in top_reacted_messages:
-                top_reacted_messages[num_reactions] = []
-            top_reacted_messages[num_reactions].append(message)
+    @profiled(count=instance_messages)
+    def __publish_top_reacted_messages(self, names, reacted_messages, num_participants):
+        # Assumming people don't react to their own messages, the most reactions
+        # you can expect is `len(participants) - 1`. The aggregate has all messages
+        # that have that maximum, or almost had the maximum.
+        num_reactions = reacted_messages.columns["num_reactions"]
 
         for i in range(num_participants - 2, num_participants + 1)[::-1]:
-            if i in top_reacted_messages:
-                self.__write_data(str(len(top_reacted_messages[i])) \
-                    + " messages with " + str(i) + " reactions")
+            num_messages = np.count_nonzero(num_reactions == i)
+            if num_messages > 0:
+                self.__write_data(str(num_messages) + " messages with " + str(i) + " reactions")
 
-        if (num_participants - 1) in top_reacted_messages:
-            self.__publish_stats_on_top_reacted_messages(messages, top_reacted_messages[num_participants - 1], num_participants)
+        top_reacted_messages = reacted_messages.with_reactions(num_participants - 1)
+        if len(top_reacted_messages) > 0:
+            self.__publish_stats_on_top_reacted_messages(names, reacted_messages, top_reacted_messages, num_participants)
 
-        if (num_participants - 2) in top_reacted_messages:
-            self.__publish_stats_on_almost_top_reacted_messages(messages, top_reacted_messages[num_participants - 2], num_participants)
+        almost_top_messages = reacted_messages.with_reactions(num_participants - 2)
+        if len(almost_top_messages) > 0:
+            self.__publish_stats_on_almost_top_reacted_messages(names, reacted_messages, almost_top_messages, \
+                num_participants)
 
 
     # Messages with (n-1) reacts
-    def __publish_stats_on_top_reacted_messages(self, messages, top_reacted_messages, num_participants):
+    @profiled(count=instance_messages)
+    def __publish_stats_on_top_reacted_messages(self, names, reacted_messages, top_reacted_messages, num_participants):
+        columns = reacted_messages.columns
         # Out of the ones with (num_participants - 1) reactions, how many had the sender give a reaction?
-        self_reacted = [m for m in top_reacted_messages if m[SENDER_NAME] in [r[ACTOR] for r in m[REACTIONS]]]
-        self.__write_data("\n" + str(len(self_reacted)) + " messages with " + str(num_participants - 1) \
+        is_self_reacted = columns["self_reacted"][top_reacted_messages]
+        self.__write_data("\n" + str(np.count_nonzero(is_self_reacted)) + " messages with " + str(num_participants - 1) \
             + " reactions where the sender also reacted.")
 
         # Out of the ones with (num_participants - 1) reactions, how many were all the same reaction?
-        same_max_reactions = [m for m in top_reacted_messages if len(set([r[REACTION] for r in m[REACTIONS]])) == 1 and m not in self_reacted]
+        num_distinct_reactions = columns["num_distinct_reactions"][top_reacted_messages]
+        same_max_reactions = top_reacted_messages[(num_distinct_reactions == 1) & ~is_self_reacted]
         self.__write_data("Out of the messages with " + str(num_participants - 1) \
             + " reactions, " + str(len(same_max_reactions)) + " had the same reaction.")
         self.__write_data("Of those, \n" \
-            + str(len([a for a in same_max_reactions if MESSAGE_CONTENT in a])) + " were text, \n" \
-            + str(len([a for a in same_max_reactions if VIDEOS in a])) + " were videos, \n" \
-            + str(len([a for a in same_max_reactions if PHOTOS in a])) + " were photos, and \n" \
-            + str(len([a for a in same_max_reactions if GIFS in a])) + " were gifs.\n")
+            + str(np.count_nonzero(columns["has_content"][same_max_reactions])) + " were text, \n" \
+            + str(np.count_nonzero(columns["has_videos"][same_max_reactions])) + " were videos, \n" \
+            + str(np.count_nonzero(columns["has_photos"][same_max_reactions])) + " were photos, and \n" \
+            + str(np.count_nonzero(columns["has_gifs"][same_max_reactions])) + " were gifs.\n")
 
         # Get rankings for (num_participants - 1) reactions that were all the same react
         self.__write_data("For the messages with " + str(num_participants - 1) + " of the same reaction:")
-        same_max_reactions_by_person = Counter([m[SENDER_NAME] for m in same_max_reactions])
-        for person, count in same_max_reactions_by_person.most_common(num_participants):
-            self.__write_data(str(person) + ": " + str(count))
+        for person, count in ranked_counts(columns["sender_codes"][same_max_reactions], num_participants):
+            self.__write_data(str(names[person]) + ": " + str(count))
 
         # Get those messages
         self.__write_data("\nHere are those messages, or one of the messages right after so we can search for it:")
-        for i, message in enumerate(same_max_reactions):
-            if MESSAGE_CONTENT in message:
-                self.__write_data(str(i+1) + ". Text: \"" + message[MESSAGE_CONTENT] + "\"")
-            else:
-                # find a message that is near that one, such that it contains text that we can search for
-                index_in_list = messages.index(message)
-                if index_in_list < 0:
-                    self.__write_data(str(i+1) + ". ERROR could not find message?!")
-                    continue
-                while index_in_list >= 0 and (MESSAGE_CONTENT not in messages[index_in_list] or len(messages[index_in_list][MESSAGE_CONTENT]) < 10):
-                    index_in_list -= 1
-                if (index_in_list < 0):
-                    self.__write_data(str(i+1) + ". ERROR no text messages sent prior to this message")
-                    continue
-                self.__write_data(str(i+1) + ". \"" + messages[index_in_list][MESSAGE_CONTENT] + "\"")
+        for i, index in enumerate(same_max_reactions.tolist()):
+            if columns["has_content"][index]:
+                self.__write_data(str(i+1) + ". Text: \"" + reacted_messages.text(columns["rows"][index]) + "\"")
+                continue
+            # a message right after that one, such that it contains text that we can search for
+            searchable_row = columns["searchable_rows"][index]
+            if searchable_row == MISSING:
+                self.__write_data(str(i+1) + ". ERROR no text messages sent after this message")
+                continue
+            self.__write_data(str(i+1) + ". \"" + reacted_messages.text(searchable_row) + "\"")
 
         # Get rankings for (num_participants - 1) reactions that were NOT all the same react
         self.__write_data("\n\nFor the messages with " + str(num_participants - 1) + " of not all the same reactions:")
-        different_max_reactions = [m for m in top_reacted_messages if len(set([r[REACTION] for r in m[REACTIONS]])) > 1 and m not in self_reacted]
-        different_max_reactions_by_person = Counter([m[SENDER_NAME] for m in different_max_reactions])
-        for person, count in different_max_reactions_by_person.most_common(num_participants):
-            self.__write_data(str(person) + ": " + str(count))
+        different_max_reactions = top_reacted_messages[(num_distinct_reactions > 1) & ~is_self_reacted]
+        for person, count in ranked_counts(columns["sender_codes"][different_max_reactions], num_participants):
+            self.__write_data(str(names[person]) + ": " + str(count))
 
 
     # Messages with (n-2) reacts
-    def __publish_stats_on_almost_top_reacted_messages(self, all_messages, almost_top_messages, num_participants):
+    @profiled(count=instance_messages)
+    def __publish_stats_on_almost_top_reacted_messages(self, names, reacted_messages, almost_top_messages, \
+            num_participants):
+        columns = reacted_messages.columns
         # any self reacts? exclude from this list
-        self_reacted = [m for m in almost_top_messages if m[SENDER_NAME] in [r[ACTOR] for r in m[REACTIONS]]]
+        is_self_reacted = columns["self_reacted"][almost_top_messages]
         self.__write_data("\n\nOut of the messages with " + str(num_participants - 2) + " reactions, " \
-            + str(len(self_reacted)) + " self-reacts")
+            + str(np.count_nonzero(is_self_reacted)) + " self-reacts")
         
         # Who wrote the message, % by participant
         self.__write_data("\nNumber of messages with " + str(num_participants - 2) + " reacts, by sender:")
-        count_by_sender = Counter([m[SENDER_NAME] for m in almost_top_messages if m not in self_reacted])
-        for person, count in count_by_sender.most_common(num_participants):
-            self.__write_data(str(person) + ": " + str(count))
+        count_by_sender = ranked_counts(columns["sender_codes"][almost_top_messages[~is_self_reacted]], num_participants)
+        for person, count in count_by_sender:
+            self.__write_data(str(names[person]) + ": " + str(count))
+
+
+    # Who reacts to whom: for each person, how many of their reactions went to each sender
+    @profiled(count=instance_messages)
+    def __publish_reactions_to_senders(self, names, reactions_to_senders):
+        self.__write_data("\n\nReactions given to each sender, by person:")
+        for actor, count in reactions_to_senders.ranked_actors():
+            self.__write_data(str(names[actor]) + " (" + str(count) + " reactions):")
+            counts_per_sender = reactions_to_senders.actor_sender_counts[actor]
+            for sender in np.argsort(-counts_per_sender, kind="stable").tolist():
+                if counts_per_sender[sender] == 0:
+                    break
+                self.__write_data("    to " + str(names[sender]) + ": " + str(counts_per_sender[sender]))
 
 
     def __write_data(self, text):
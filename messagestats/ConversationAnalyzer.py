@@ -0,0 +1,134 @@
+from profiling.StageProfiler import profiled, instance_messages
+import numpy as np
+import os
+
+
+OUTPUT_DIRECTORY = "statistics/"
+OUTPUT_FILENAME = "conversations.txt"
+
+MS_PER_MINUTE = 60 * 1000
+# Conversation durations are counted in buckets split at these lengths
+DURATION_BUCKET_MINUTES = [1, 5, 15, 30, 60, 120, 240]
+REPLY_LATENCY_PERCENTILES = [50, 90]
+
+
+"""
+Outputs a txt file with stats on the conversations of the chat, from a
+ConversationIndex: how many there are and how long they last, how quickly each
+person replies, and who starts and ends them.
+"""
+class ConversationAnalyzer:
+    def __init__(self, output_directory_path):
+        self.output_directory_path = output_directory_path + OUTPUT_DIRECTORY
+        self.output_file_path = self.output_directory_path + OUTPUT_FILENAME
+        return
+
+
+    def generate_stats(self, table, time_index, conversation_index):
+        self.num_messages = len(table)
+        if not os.path.exists(self.output_directory_path):
+            os.makedirs(self.output_directory_path)
+        self.file = open(self.output_file_path, "w")
+
+        self.__write_data("Conversations are separated by more than " \
+            + format_duration(conversation_index.idle_gap_ms) + " without messages\n")
+        self.__publish_conversation_sizes(time_index, conversation_index)
+        self.__publish_reply_latencies(table.names, conversation_index)
+        self.__publish_starters_and_enders(table.names, conversation_index)
+
+        self.file.close()
+
+
+    @profiled(count=instance_messages)
+    def __publish_conversation_sizes(self, time_index, conversation_index):
+        self.__write_data(str(len(conversation_index)) + " conversations")
+        if len(conversation_index) == 0:
+            return
+        self.__write_data("Average conversation: " + str(round(conversation_index.sizes.mean(), 2)) \
+            + " messages over " + format_duration(conversation_index.durations_ms.mean()))
+
+        # Ties go to the earliest conversation
+        longest = int(np.argmax(conversation_index.durations_ms))
+        self.__write_data("Longest conversation: " + str(conversation_index.sizes[longest]) + " messages over " \
+            + format_duration(conversation_index.durations_ms[longest]) + ", starting on " \
+            + time_index.days[conversation_index.starts[longest]].astype(object).strftime("%B %d, %Y"))
+        biggest = int(np.argmax(conversation_index.sizes))
+        self.__write_data("Biggest conversation: " + str(conversation_index.sizes[biggest]) + " messages over " \
+            + format_duration(conversation_index.durations_ms[biggest]) + ", starting on " \
+            + time_index.days[conversation_index.starts[biggest]].astype(object).strftime("%B %d, %Y"))
+
+        self.__write_data("\nConversations by number of messages:")
+        histogram = conversation_index.size_histogram()
+        for label, count in zip(size_bucket_labels(histogram), histogram.tolist()):
+            self.__write_data(label + ": " + str(count))
+
+        self.__write_data("\nConversations by length:")
+        histogram = conversation_index.duration_histogram(np.array(DURATION_BUCKET_MINUTES) * MS_PER_MINUTE)
+        for label, count in zip(duration_bucket_labels(DURATION_BUCKET_MINUTES), histogram.tolist()):
+            self.__write_data(label + ": " + str(count))
+
+
+    @profiled(count=instance_messages)
+    def __publish_reply_latencies(self, names, conversation_index):
+        self.__write_data("\n\nReply times, by person (" \
+            + ", ".join(percentile_label(percentile) for percentile in REPLY_LATENCY_PERCENTILES) + "):")
+        percentiles = [conversation_index.reply_latency_percentiles(percentile) \
+            for percentile in REPLY_LATENCY_PERCENTILES]
+        # Fastest median first
+        for person in np.argsort(percentiles[0], kind="stable").tolist():
+            if conversation_index.reply_counts[person] == 0:
+                continue
+            self.__write_data(str(names[person]) + ": " \
+                + ", ".join(format_duration(values[person]) for values in percentiles) \
+                + " (" + str(conversation_index.reply_counts[person]) + " replies)")
+
+
+    @profiled(count=instance_messages)
+    def __publish_starters_and_enders(self, names, conversation_index):
+        for title, counts in [("started", conversation_index.starter_counts), \
+                ("ended", conversation_index.ender_counts)]:
+            self.__write_data("\n\nConversations " + title + ", by person:")
+            for person in np.argsort(-counts, kind="stable").tolist():
+                if counts[person] == 0:
+                    break
+                self.__write_data(str(names[person]) + ": " + str(counts[person]) \
+                    + " (" + "{:.0%}".format(counts[person] / len(conversation_index)) + ")")
+
+
+    def __write_data(self, text):
+        self.file.write(text + "\n")
+
+
+# e.g. "45 seconds", "12.5 minutes", "3.2 hours"
+def format_duration(duration_ms):
+    if duration_ms < MS_PER_MINUTE:
+        return str(round(duration_ms / 1000, 1)) + " seconds"
+    if duration_ms < 60 * MS_PER_MINUTE:
+        return str(round(duration_ms / MS_PER_MINUTE, 1)) + " minutes"
+    return str(round(duration_ms / 60 / MS_PER_MINUTE, 1)) + " hours"
+
+
+# Labels of ConversationIndex.size_histogram's buckets: "1", "2", "3-4", "5-8"...
+def size_bucket_labels(histogram):
+    labels = []
+    for bucket in range(len(histogram)):
+        low, high = 2 ** (bucket - 1) + 1 if bucket > 0 else 1, 2 ** bucket
+        labels.append(str(low) if low == high else str(low) + "-" + str(high))
+    return labels
+
+
+# Labels of the buckets split at `bucket_minutes`, e.g. "under 1 min", "1-5 min", "4 h or more"
+def duration_bucket_labels(bucket_minutes):
+    def format_minutes(minutes):
+        return str(minutes) + " min" if minutes < 60 else str(minutes // 60) + " h"
+    def format_range(low, high):
+        if low < 60 <= high:
+            return format_minutes(low) + " to " + format_minutes(high)
+        return format_minutes(low).split()[0] + "-" + format_minutes(high)
+    return ["under " + format_minutes(bucket_minutes[0])] \
+        + [format_range(low, high) for low, high in zip(bucket_minutes[:-1], bucket_minutes[1:])] \
+        + [format_minutes(bucket_minutes[-1]) + " or more"]
+
+
+def percentile_label(percentile):
+    return "median" if percentile == 50 else str(percentile) + "th percentile"
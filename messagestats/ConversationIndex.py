@@ -0,0 +1,83 @@
+import numpy as np
+
+
+"""
+Conversations (sessions) of a MessageTable: runs of messages where each message
+follows the previous one by at most `idle_gap_ms`. Everything is computed with NumPy
+from the gaps between consecutive timestamps (the table must be sorted by time, e.g.
+by `merge_sorted`), so tens of millions of messages take seconds.
+
+Conversation `i` is rows `starts[i]` to `ends[i]` (inclusive). A reply is a message
+that follows a message by someone else in the same conversation, and its latency is
+the time since that message. `reply_latencies_ms` holds every reply's latency,
+grouped by sender and sorted within each sender: those of name code `p` are
+`reply_latencies_ms[reply_offsets[p]:reply_offsets[p + 1]]`, and
+`replier_sender_counts[replier, sender]` is how often `replier` replied to a message
+by `sender` (like ReactionIndex's `actor_sender_counts`, a dense participants x
+participants matrix).
+"""
+class ConversationIndex:
+    def __init__(self, table, idle_gap_ms):
+        num_names, num_messages = len(table.names), len(table)
+        timestamps, sender_codes = table.timestamps, table.sender_codes
+        self.idle_gap_ms = idle_gap_ms
+
+        gaps = np.diff(timestamps)
+        is_start = np.ones(num_messages, dtype=bool)
+        is_start[1:] = gaps > idle_gap_ms
+        self.starts = np.flatnonzero(is_start)
+        # An empty table has no conversations
+        self.ends = np.append(self.starts[1:], num_messages)[:len(self.starts)] - 1
+        self.sizes = self.ends - self.starts + 1
+        self.durations_ms = timestamps[self.ends] - timestamps[self.starts]
+        self.starter_counts = np.bincount(sender_codes[self.starts], minlength=num_names)
+        self.ender_counts = np.bincount(sender_codes[self.ends], minlength=num_names)
+
+        # Replies, sorted by sender and then latency. Latencies are at most `idle_gap_ms`,
+        # so both fit in one sort key.
+        is_reply = ~is_start[1:] & (sender_codes[1:] != sender_codes[:-1])
+        reply_senders = sender_codes[1:][is_reply].astype(np.int64)
+        keys = np.sort(reply_senders * (idle_gap_ms + 1) + gaps[is_reply])
+        self.reply_latencies_ms = keys % (idle_gap_ms + 1)
+        self.reply_counts = np.bincount(reply_senders, minlength=num_names)
+        self.reply_offsets = np.zeros(num_names + 1, dtype=np.int64)
+        np.cumsum(self.reply_counts, out=self.reply_offsets[1:])
+        replied_senders = sender_codes[:-1][is_reply]
+        self.replier_sender_counts = np.bincount(reply_senders * num_names + replied_senders, \
+            minlength=num_names * num_names).reshape(num_names, num_names)
+        return
+
+
+    def __len__(self):
+        return len(self.starts)
+
+
+    # The `percentile` (0-100) of each sender's reply latencies, interpolated like
+    # np.percentile, or NaN for senders without replies
+    def reply_latency_percentiles(self, percentile):
+        has_replies = self.reply_counts > 0
+        positions = self.reply_offsets[:-1] + (percentile / 100) * np.maximum(self.reply_counts - 1, 0)
+        lower = np.floor(positions).astype(np.int64)
+        upper = np.minimum(lower + 1, self.reply_offsets[1:] - 1)
+        lower, upper = lower[has_replies], upper[has_replies]
+        values = np.full(len(self.reply_counts), np.nan)
+        fractions = positions[has_replies] - lower
+        values[has_replies] = self.reply_latencies_ms[lower] * (1 - fractions) \
+            + self.reply_latencies_ms[upper] * fractions
+        return values
+
+
+    # Number of conversations per size bucket: 1 message, 2, 3-4, 5-8, ... with bucket
+    # `k > 0` holding sizes 2^(k-1)+1 to 2^k
+    def size_histogram(self):
+        if len(self) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return np.bincount(np.ceil(np.log2(self.sizes)).astype(np.int64))
+
+
+    # Number of conversations per duration bucket, split at each of the sorted
+    # `bucket_edges_ms`: shorter than the first edge, between each pair, and at
+    # least the last one
+    def duration_histogram(self, bucket_edges_ms):
+        buckets = np.searchsorted(bucket_edges_ms, self.durations_ms, side="right")
+        return np.bincount(buckets, minlength=len(bucket_edges_ms) + 1)
@@ -0,0 +1,66 @@
+import numpy as np
+
+
+"""
+Reaction counts built in one pass over a MessageTable's reaction columns, shared by
+the reaction graphs and statistics.
+
+Matrices are indexed by the table's codes:
+- `actor_reaction_counts[actor, reaction]`: how often `actor` used `reaction`
+- `actor_sender_counts[actor, sender]`: how often `actor` reacted to a message by `sender`
+
+Both are dense: their sizes are (participants x distinct reactions) and
+(participants x participants), which stay small even when the chat is huge.
+"""
+class ReactionIndex:
+    def __init__(self, table):
+        num_names, num_reactions = len(table.names), max(len(table.reactions), 1)
+        num_reaction_rows = len(table.reaction_codes)
+        message_indices = table.reaction_message_indices()
+        actor_codes, reaction_codes = table.reaction_actor_codes, table.reaction_codes
+        sender_codes = table.sender_codes[message_indices]
+
+        actor_reactions = actor_codes.astype(np.int64) * num_reactions + reaction_codes
+        self.actor_reaction_counts = np.bincount(actor_reactions, \
+            minlength=num_names * num_reactions).reshape(num_names, num_reactions)
+        self.actor_sender_counts = np.bincount(actor_codes.astype(np.int64) * num_names + sender_codes, \
+            minlength=num_names * num_names).reshape(num_names, num_names)
+
+        # First reaction row of each (actor, reaction) pair and of each actor, so that
+        # rankings can break ties by first occurrence like Counter.most_common
+        self.num_reaction_rows = num_reaction_rows
+        self.first_actor_reaction_rows = np.full(num_names * num_reactions, num_reaction_rows, dtype=np.int64)
+        np.minimum.at(self.first_actor_reaction_rows, actor_reactions, np.arange(num_reaction_rows))
+        self.first_actor_reaction_rows = self.first_actor_reaction_rows.reshape(num_names, num_reactions)
+        self.first_actor_rows = self.first_actor_reaction_rows.min(axis=1)
+
+        self.reactions_given = self.actor_reaction_counts.sum(axis=1)
+        self.reactions_received = self.actor_sender_counts.sum(axis=0)
+
+        # Per message
+        self.reactions_per_message = table.reaction_counts()
+        is_sender = actor_codes == sender_codes
+        self.self_reacted = np.bincount(message_indices[is_sender], minlength=len(table)) > 0
+        unique_message_reactions = np.unique(message_indices * num_reactions + reaction_codes)
+        self.distinct_reactions_per_message = np.bincount(unique_message_reactions // num_reactions, \
+            minlength=len(table))
+        return
+
+
+    # (actor, count) pairs for everyone who reacted, most reactions given first
+    def ranked_actors(self):
+        actors = np.flatnonzero(self.reactions_given)
+        order = np.lexsort((self.first_actor_rows[actors], -self.reactions_given[actors]))
+        return [(int(actor), int(self.reactions_given[actor])) for actor in actors[order]]
+
+
+    # The `k` (reaction, count) pairs that `actor` used most, most common first
+    def top_reactions(self, actor, k):
+        counts = self.actor_reaction_counts[actor]
+        used = np.flatnonzero(counts)
+        # Unique sort key: higher count first, then earlier first use
+        keys = -counts[used] * (self.num_reaction_rows + 1) + self.first_actor_reaction_rows[actor, used]
+        if len(used) > k:
+            partition = np.argpartition(keys, k - 1)[:k]
+            used, keys = used[partition], keys[partition]
+        return [(int(reaction), int(counts[reaction])) for reaction in used[np.argsort(keys)]]
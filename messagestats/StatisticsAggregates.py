@@ -0,0 +1,296 @@
+from messagestats.ReactionIndex import ReactionIndex
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+import multiprocessing, os
+import numpy as np
+
+
+MIN_SEARCHABLE_TEXT_LENGTH = 10
+# Smallest shard worth aggregating in another process
+MIN_SHARD_MESSAGES = 250000
+# Row of something that doesn't exist, e.g. the first text message of a day without any
+MISSING = np.iinfo(np.int64).max
+
+# Table and data sharded across the worker processes of `aggregate_statistics`. With
+# the "fork" start method the workers inherit them, so the table is never pickled.
+SHARED_SHARD_DATA = {}
+
+
+"""
+Partial aggregates of the statistics in AggregatedMessageAnalyzer. Each is computed
+from one shard of the messages with `from_shard`, and `a.merge(b)` combines the
+aggregates of two consecutive shards into the aggregate of both, so shards can be
+aggregated in separate processes and reduced at the end.
+
+Shards are consecutive row ranges of one MessageTable (e.g. `table.slice`), so
+they share its name codes, and rows are counted from the start of the first shard.
+A later shard can also come from a table whose names extend the earlier shard's,
+e.g. when new messages are merged into aggregates saved by an earlier run.
+Merging is associative, but not commutative: `a` must be the earlier shard, which is
+how ties keep going to the earliest message like in the single-pass version.
+"""
+class StatisticsAggregate:
+    def __init__(self, totals, daily_activity, reacted_messages, reactions_to_senders):
+        self.totals = totals
+        self.daily_activity = daily_activity
+        self.reacted_messages = reacted_messages
+        self.reactions_to_senders = reactions_to_senders
+        return
+
+    # `days` are the local days of the shard's messages, e.g. from `TimeIndex.days`. The
+    # shard's `reaction_index` and `activity_index` can be passed in if there already are.
+    @classmethod
+    def from_shard(cls, table, participants, days, reaction_index=None, activity_index=None):
+        if reaction_index is None:
+            reaction_index = ReactionIndex(table)
+        return cls(
+            MessageTotals.from_shard(table, participants),
+            DailyActivity.from_shard(table, days, activity_index),
+            ReactedMessages.from_shard(table, reaction_index, len(participants) - 2),
+            ReactionsToSenders.from_shard(reaction_index),
+        )
+
+    def merge(self, other):
+        return StatisticsAggregate(
+            self.totals.merge(other.totals),
+            self.daily_activity.merge(other.daily_activity),
+            self.reacted_messages.merge(other.reacted_messages),
+            self.reactions_to_senders.merge(other.reactions_to_senders),
+        )
+
+
+"""
+Number of messages and participants
+"""
+class MessageTotals:
+    def __init__(self, num_messages, participants):
+        self.num_messages = num_messages
+        self.participants = participants
+        return
+
+    @classmethod
+    def from_shard(cls, table, participants):
+        return cls(len(table), set(participants))
+
+    def merge(self, other):
+        return MessageTotals(self.num_messages + other.num_messages, self.participants | other.participants)
+
+
+"""
+Messages per day, over every day from the first to the last message, and the first
+text message of each day
+"""
+class DailyActivity:
+    def __init__(self, first_day, counts, first_text_rows, texts, num_messages):
+        self.first_day = first_day
+        self.counts = counts
+        self.first_text_rows = first_text_rows
+        # Text of each row in `first_text_rows`
+        self.texts = texts
+        self.num_messages = num_messages
+        return
+
+    @classmethod
+    def from_shard(cls, table, days, activity_index=None):
+        if len(table) == 0:
+            return cls(None, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), {}, 0)
+        if activity_index is not None:
+            first_day, counts = activity_index.first_day, activity_index.messages_per_day
+        else:
+            first_day = days.min()
+            counts = np.bincount((days - first_day).astype(np.int64))
+        first_text_rows = np.full(len(counts), MISSING, dtype=np.int64)
+        text_rows = np.flatnonzero(table.has_content)
+        np.minimum.at(first_text_rows, (days[text_rows] - first_day).astype(np.int64), text_rows)
+        texts = {row: table.contents[row] for row in first_text_rows[first_text_rows != MISSING].tolist()}
+        return cls(first_day, counts, first_text_rows, texts, len(table))
+
+    def merge(self, other):
+        num_messages = self.num_messages + other.num_messages
+        other_rows = offset_rows(other.first_text_rows, self.num_messages)
+        parts = [part for part in [(self.first_day, self.counts, self.first_text_rows), \
+            (other.first_day, other.counts, other_rows)] if part[0] is not None]
+        if not parts:
+            return DailyActivity(None, self.counts, self.first_text_rows, {}, num_messages)
+
+        first_day = min(day for day, counts, rows in parts)
+        num_days = max(int((day - first_day).astype(np.int64)) + len(counts) for day, counts, rows in parts)
+        counts = np.zeros(num_days, dtype=np.int64)
+        first_text_rows = np.full(num_days, MISSING, dtype=np.int64)
+        for day, part_counts, part_rows in parts:
+            start = int((day - first_day).astype(np.int64))
+            counts[start:start + len(part_counts)] += part_counts
+            np.minimum(first_text_rows[start:start + len(part_rows)], part_rows, \
+                out=first_text_rows[start:start + len(part_rows)])
+
+        texts = dict(self.texts)
+        texts.update((row + self.num_messages, text) for row, text in other.texts.items())
+        kept_rows = first_text_rows[first_text_rows != MISSING].tolist()
+        return DailyActivity(first_day, counts, first_text_rows, {row: texts[row] for row in kept_rows}, num_messages)
+
+    def day_at(self, day_id):
+        return (self.first_day + day_id).astype(object)
+
+    # First text message of a day, or None
+    def first_text(self, day_id):
+        return self.texts.get(int(self.first_text_rows[day_id]))
+
+
+"""
+Messages with at least `min_reactions` reactions, in order, with what the statistics
+need about each one. Messages without text also get the first message at or after
+them with searchable text; when that message is in a later shard, it is filled in by
+`merge`.
+"""
+class ReactedMessages:
+    COLUMNS = ["rows", "sender_codes", "num_reactions", "num_distinct_reactions", "self_reacted", \
+        "has_content", "has_videos", "has_photos", "has_gifs", "searchable_rows"]
+
+    def __init__(self, min_reactions, columns, first_searchable_row, texts, num_messages):
+        self.min_reactions = min_reactions
+        # Arrays with one entry per reacted message, see COLUMNS
+        self.columns = columns
+        # First message of the shard with searchable text, for the previous shard
+        self.first_searchable_row = first_searchable_row
+        # Text of the reacted messages and of the searchable rows
+        self.texts = texts
+        self.num_messages = num_messages
+        return
+
+    @classmethod
+    def from_shard(cls, table, reaction_index, min_reactions):
+        num_reactions = reaction_index.reactions_per_message
+        rows = np.flatnonzero(table.has_reactions & (num_reactions >= min_reactions))
+        is_searchable = table.content_lengths() >= MIN_SEARCHABLE_TEXT_LENGTH
+        next_searchable_rows = np.minimum.accumulate(np.where(is_searchable, np.arange(len(table)), MISSING)[::-1])[::-1]
+
+        columns = {
+            "rows": rows,
+            "sender_codes": table.sender_codes[rows],
+            "num_reactions": num_reactions[rows],
+            "num_distinct_reactions": reaction_index.distinct_reactions_per_message[rows],
+            "self_reacted": reaction_index.self_reacted[rows],
+            "has_content": table.has_content[rows],
+            "has_videos": table.has_videos[rows],
+            "has_photos": table.has_photos[rows],
+            "has_gifs": table.has_gifs[rows],
+            "searchable_rows": next_searchable_rows[rows],
+        }
+        first_searchable_row = int(next_searchable_rows[0]) if len(table) else MISSING
+        aggregate = cls(min_reactions, columns, first_searchable_row, {}, len(table))
+        aggregate.texts = {row: table.contents[row] for row in aggregate.__text_rows()}
+        return aggregate
+
+    def merge(self, other):
+        columns = {column: np.concatenate([self.columns[column], other.columns[column]]) for column in self.COLUMNS}
+        num_rows = len(self.columns["rows"])
+        columns["rows"][num_rows:] += self.num_messages
+        columns["searchable_rows"][num_rows:] = offset_rows(other.columns["searchable_rows"], self.num_messages)
+        # Messages at the end of this shard continue into the other one
+        other_first_searchable_row = int(offset_rows(np.array([other.first_searchable_row]), self.num_messages)[0])
+        searchable_rows = columns["searchable_rows"][:num_rows]
+        searchable_rows[searchable_rows == MISSING] = other_first_searchable_row
+        first_searchable_row = self.first_searchable_row if self.first_searchable_row != MISSING \
+            else other_first_searchable_row
+
+        texts = dict(self.texts)
+        texts.update((row + self.num_messages, text) for row, text in other.texts.items())
+        aggregate = ReactedMessages(self.min_reactions, columns, first_searchable_row, {}, \
+            self.num_messages + other.num_messages)
+        aggregate.texts = {row: texts[row] for row in aggregate.__text_rows()}
+        return aggregate
+
+    # Indices (into the columns) of the messages with exactly `num_reactions` reactions
+    def with_reactions(self, num_reactions):
+        return np.flatnonzero(self.columns["num_reactions"] == num_reactions)
+
+    def text(self, row):
+        return self.texts.get(int(row))
+
+    def __text_rows(self):
+        rows = self.columns["rows"][self.columns["has_content"]].tolist() + self.columns["searchable_rows"].tolist() \
+            + [self.first_searchable_row]
+        return set(row for row in rows if row != MISSING)
+
+
+"""
+Reactions each actor gave to each sender, and each actor's first reaction, which
+breaks ties when ranking actors
+"""
+class ReactionsToSenders:
+    def __init__(self, actor_sender_counts, first_actor_rows, num_reaction_rows):
+        self.actor_sender_counts = actor_sender_counts
+        self.first_actor_rows = first_actor_rows
+        self.num_reaction_rows = num_reaction_rows
+        return
+
+    @classmethod
+    def from_shard(cls, reaction_index):
+        first_actor_rows = np.where(reaction_index.first_actor_rows == reaction_index.num_reaction_rows, MISSING, \
+            reaction_index.first_actor_rows)
+        return cls(reaction_index.actor_sender_counts, first_actor_rows, reaction_index.num_reaction_rows)
+
+    def merge(self, other):
+        num_names = max(len(self.first_actor_rows), len(other.first_actor_rows))
+        first_actor_rows = padded(self.first_actor_rows, (num_names,), MISSING)
+        first_actor_rows = np.where(first_actor_rows != MISSING, first_actor_rows, \
+            offset_rows(padded(other.first_actor_rows, (num_names,), MISSING), self.num_reaction_rows))
+        actor_sender_counts = padded(self.actor_sender_counts, (num_names, num_names), 0) \
+            + padded(other.actor_sender_counts, (num_names, num_names), 0)
+        return ReactionsToSenders(actor_sender_counts, first_actor_rows, \
+            self.num_reaction_rows + other.num_reaction_rows)
+
+    # (actor, count) pairs for everyone who reacted, most reactions given first
+    def ranked_actors(self):
+        reactions_given = self.actor_sender_counts.sum(axis=1)
+        actors = np.flatnonzero(reactions_given)
+        order = np.lexsort((self.first_actor_rows[actors], -reactions_given[actors]))
+        return [(int(actor), int(reactions_given[actor])) for actor in actors[order]]
+
+
+# Aggregates the statistics of `table` in shards of at least MIN_SHARD_MESSAGES messages,
+# one per worker process, and merges them. Small tables are aggregated in this process,
+# reusing `reaction_index` and `activity_index` if given.
+def aggregate_statistics(table, participants, days, reaction_index=None, activity_index=None, num_workers=None):
+    num_shards = min(num_workers or os.cpu_count() or 1, len(table) // MIN_SHARD_MESSAGES)
+    if num_shards <= 1:
+        return StatisticsAggregate.from_shard(table, participants, days, reaction_index, activity_index)
+
+    SHARED_SHARD_DATA.update(table=table, participants=participants, days=days)
+    # Only where fork is the platform's default: e.g. macOS defaults to spawn, as forking
+    # after its system frameworks are initialized is unsafe
+    if multiprocessing.get_start_method() == "fork":
+        context, initargs = multiprocessing.get_context("fork"), ()
+    else:
+        context, initargs = multiprocessing.get_context(), (dict(SHARED_SHARD_DATA),)
+
+    bounds = np.linspace(0, len(table), num_shards + 1).astype(np.int64).tolist()
+    with ProcessPoolExecutor(num_shards, mp_context=context, initializer=initialize_shard_worker, \
+            initargs=initargs) as pool:
+        aggregates = list(pool.map(aggregate_shard, bounds[:-1], bounds[1:]))
+    SHARED_SHARD_DATA.clear()
+    return reduce(StatisticsAggregate.merge, aggregates)
+
+
+def initialize_shard_worker(data=None):
+    if data is not None:
+        SHARED_SHARD_DATA.update(data)
+
+
+# Runs in a worker process: aggregates rows [start, end) of the shared table
+def aggregate_shard(start, end):
+    table, days = SHARED_SHARD_DATA["table"], SHARED_SHARD_DATA["days"]
+    return StatisticsAggregate.from_shard(table.slice(start, end), SHARED_SHARD_DATA["participants"], days[start:end])
+
+
+def offset_rows(rows, offset):
+    return np.where(rows == MISSING, MISSING, rows + offset)
+
+
+# `array` grown to `shape` with `fill`, for aggregates with fewer name codes
+def padded(array, shape, fill):
+    if array.shape == shape:
+        return array
+    grown = np.full(shape, fill, dtype=array.dtype)
+    grown[tuple(slice(0, size) for size in array.shape)] = array
+    return grown
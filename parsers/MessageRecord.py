@@ -0,0 +1,117 @@
+from parsers.MessageTable import CategoryEncoder
+from collections.abc import Mapping
+
+
+# JSON field names
+SENDER_NAME = "sender_name"
+TIMESTAMP_MS = "timestamp_ms"
+MESSAGE_TYPE = "type"
+MESSAGE_CONTENT = "content"
+REACTIONS = "reactions"
+REACTION = "reaction"
+ACTOR = "actor"
+REACTION_FIELDS = {REACTION, ACTOR}
+
+
+"""
+Categories shared by the MessageRecords of one parse. Senders and actors share the
+`names` codes, like in MessageTable.
+"""
+class RecordCategories:
+    def __init__(self):
+        self.names = CategoryEncoder()
+        self.types = CategoryEncoder()
+        self.reactions = CategoryEncoder()
+        return
+
+
+"""
+Compact stand-in for a message dict. The sender, type and reactions are stored as
+codes into RecordCategories, so each distinct name or emoji is kept once however
+many messages use it, and reactions are a flat tuple of (actor, reaction) code pairs
+instead of a list of dicts. Fields that don't fit these slots (media, shares, etc.)
+are kept as they are in `extra`.
+
+Records are read-only Mappings with the same keys and values as the original dict,
+so code written for message dicts (`message["sender_name"]`, `message.get(...)`,
+`"photos" in message`, `MessageTable.from_messages`) works with them unchanged.
+Values like the reaction dicts are rebuilt on each access.
+"""
+class MessageRecord(Mapping):
+    __slots__ = ("categories", "timestamp_ms", "sender_code", "type_code", "content", "reaction_codes", "extra")
+
+    def __init__(self, categories, timestamp_ms, sender_code, type_code, content, reaction_codes, extra):
+        self.categories = categories
+        self.timestamp_ms = timestamp_ms
+        self.sender_code = sender_code
+        self.type_code = type_code
+        self.content = content
+        self.reaction_codes = reaction_codes
+        self.extra = extra
+        return
+
+
+    # Fields with an unexpected shape (e.g. a reaction without an actor) are kept in
+    # `extra`, so that the record always reads back as the original dict
+    @classmethod
+    def from_message(cls, message, categories):
+        extra = dict(message)
+        timestamp_ms, sender_code, type_code, content, reaction_codes = None, -1, -1, None, None
+
+        if type(extra.get(TIMESTAMP_MS)) is int:
+            timestamp_ms = extra.pop(TIMESTAMP_MS)
+        if isinstance(extra.get(SENDER_NAME), str):
+            sender_code = categories.names.code(extra.pop(SENDER_NAME))
+        if isinstance(extra.get(MESSAGE_TYPE), str):
+            type_code = categories.types.code(extra.pop(MESSAGE_TYPE))
+        if isinstance(extra.get(MESSAGE_CONTENT), str):
+            content = extra.pop(MESSAGE_CONTENT)
+        if is_plain_reaction_list(extra.get(REACTIONS)):
+            reaction_codes = tuple(code for reaction in extra.pop(REACTIONS) \
+                for code in (categories.names.code(reaction[ACTOR]), categories.reactions.code(reaction[REACTION])))
+
+        return cls(categories, timestamp_ms, sender_code, type_code, content, reaction_codes, extra or None)
+
+
+    def __getitem__(self, key):
+        if key == TIMESTAMP_MS and self.timestamp_ms is not None:
+            return self.timestamp_ms
+        if key == SENDER_NAME and self.sender_code >= 0:
+            return self.categories.names.values[self.sender_code]
+        if key == MESSAGE_TYPE and self.type_code >= 0:
+            return self.categories.types.values[self.type_code]
+        if key == MESSAGE_CONTENT and self.content is not None:
+            return self.content
+        if key == REACTIONS and self.reaction_codes is not None:
+            names, reactions = self.categories.names.values, self.categories.reactions.values
+            codes = self.reaction_codes
+            return [{REACTION: reactions[codes[i + 1]], ACTOR: names[codes[i]]} for i in range(0, len(codes), 2)]
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self):
+        if self.sender_code >= 0:
+            yield SENDER_NAME
+        if self.timestamp_ms is not None:
+            yield TIMESTAMP_MS
+        if self.content is not None:
+            yield MESSAGE_CONTENT
+        if self.reaction_codes is not None:
+            yield REACTIONS
+        if self.type_code >= 0:
+            yield MESSAGE_TYPE
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    def __repr__(self):
+        return "MessageRecord(" + repr(dict(self)) + ")"
+
+
+# Reactions that can be stored as code pairs: a list of {"reaction": str, "actor": str}
+def is_plain_reaction_list(reactions):
+    return isinstance(reactions, list) and all(isinstance(reaction, dict) and reaction.keys() == REACTION_FIELDS \
+        and isinstance(reaction[REACTION], str) and isinstance(reaction[ACTOR], str) for reaction in reactions)
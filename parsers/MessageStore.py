@@ -0,0 +1,222 @@
+from parsers.TextNormalizer import repair_mojibake
+import hashlib, sqlite3
+import numpy as np
+
+
+# Bump when the schema changes, so that old databases are rebuilt
+STORE_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE people (id INTEGER PRIMARY KEY, name TEXT NOT NULL, is_participant INTEGER NOT NULL);
+CREATE TABLE messages (
+    id INTEGER PRIMARY KEY,
+    timestamp_ms INTEGER NOT NULL,
+    day TEXT NOT NULL,
+    sender_id INTEGER NOT NULL REFERENCES people(id),
+    type TEXT NOT NULL,
+    content TEXT,
+    has_videos INTEGER NOT NULL,
+    has_photos INTEGER NOT NULL,
+    has_gifs INTEGER NOT NULL
+);
+CREATE TABLE reactions (
+    message_id INTEGER NOT NULL REFERENCES messages(id),
+    actor_id INTEGER NOT NULL REFERENCES people(id),
+    reaction TEXT NOT NULL
+);
+"""
+# Created after the rows are inserted, which is faster than updating them row by row
+INDEXES = """
+CREATE INDEX messages_timestamp ON messages(timestamp_ms);
+CREATE INDEX messages_sender_timestamp ON messages(sender_id, timestamp_ms);
+CREATE INDEX messages_day ON messages(day);
+CREATE INDEX reactions_message ON reactions(message_id);
+CREATE INDEX reactions_actor ON reactions(actor_id, reaction);
+"""
+TABLES = ["metadata", "people", "messages", "reactions"]
+
+# Metadata keys
+VERSION = "version"
+CONTENT_HASH = "content_hash"
+
+
+"""
+SQLite database of a chat's messages, reactions and participants, for filtered and
+repeated questions that would otherwise each need a full scan of the MessageTable,
+e.g. the messages of one person in a date range or the reactions of one actor.
+
+The database persists between runs and is only rebuilt when the messages (or the
+timezone used for the `day` column) change. Rows use the MessageTable's order, so a
+message's `id` is its index in the table, and names, reactions and contents are
+stored repaired. The queries below reproduce the statistics of
+AggregatedMessageAnalyzer.
+"""
+class MessageStore:
+    def __init__(self, database_path):
+        self.database_path = database_path
+        # Transactions are explicit, see `load`
+        self.connection = sqlite3.connect(database_path, isolation_level=None)
+        return
+
+
+    # Loads the table unless the database already holds the same messages. Returns
+    # whether the database was rebuilt.
+    def load(self, table, participants, time_index):
+        content_hash = table_content_hash(table, participants, time_index)
+        if self.__get_metadata(VERSION) == str(STORE_VERSION) and self.__get_metadata(CONTENT_HASH) == content_hash:
+            return False
+
+        # One transaction, so that an interrupted load leaves the previous database
+        self.connection.execute("BEGIN")
+        try:
+            for name in TABLES:
+                self.connection.execute("DROP TABLE IF EXISTS " + name)
+            execute_script(self.connection, SCHEMA)
+
+            # Names and reactions are already repaired by MessageTable, unlike the contents
+            names = table.names
+            people = names + sorted(set(participants) - set(names))
+            self.connection.executemany("INSERT INTO people VALUES (?, ?, ?)", \
+                [(i, name, name in participants) for i, name in enumerate(people)])
+
+            days = np.datetime_as_string(time_index.first_day + np.arange(time_index.num_days)).tolist()
+            types = np.array(table.types, dtype=object)[table.type_codes].tolist() if len(table) else []
+            self.connection.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", zip(
+                range(len(table)), table.timestamps.tolist(), [days[day] for day in time_index.day_ids.tolist()], \
+                table.sender_codes.tolist(), types, \
+                [repair_mojibake(content) if content is not None else None for content in table.contents], \
+                table.has_videos.tolist(), table.has_photos.tolist(), table.has_gifs.tolist()))
+
+            reactions = table.reactions
+            self.connection.executemany("INSERT INTO reactions VALUES (?, ?, ?)", zip(
+                table.reaction_message_indices().tolist(), table.reaction_actor_codes.tolist(), \
+                [reactions[code] for code in table.reaction_codes.tolist()]))
+
+            execute_script(self.connection, INDEXES)
+            self.connection.executemany("INSERT INTO metadata VALUES (?, ?)", \
+                [(VERSION, str(STORE_VERSION)), (CONTENT_HASH, content_hash)])
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+        self.connection.execute("ANALYZE")
+        return True
+
+
+    def close(self):
+        self.connection.close()
+
+
+    # Totals
+    def count_messages(self):
+        return self.__query_value("SELECT COUNT(*) FROM messages")
+
+    def count_participants(self):
+        return self.__query_value("SELECT COUNT(*) FROM people WHERE is_participant")
+
+
+    # [(day, count)] for every day with messages, optionally only those of `sender`
+    def messages_per_day(self, sender=None):
+        return self.__query("SELECT day, COUNT(*) FROM messages" + self.__sender_filter(sender) \
+            + " GROUP BY day ORDER BY day", self.__sender_arguments(sender))
+
+    # [(day, count)] of the days with the most messages, ties going to the earliest day
+    def busiest_days(self, limit, sender=None):
+        return self.__query("SELECT day, COUNT(*) AS count FROM messages" + self.__sender_filter(sender) \
+            + " GROUP BY day ORDER BY count DESC, day LIMIT ?", self.__sender_arguments(sender) + [limit])
+
+    # First message of `day` with text, or None
+    def sample_message(self, day):
+        return self.__query_value("SELECT content FROM messages WHERE day = ? AND content IS NOT NULL " \
+            + "ORDER BY id LIMIT 1", [day])
+
+
+    # [(timestamp_ms, sender, content)] in chronological order, optionally only those of
+    # `sender` and in [since_ms, until_ms)
+    def messages(self, sender=None, since_ms=None, until_ms=None):
+        conditions, arguments = [], []
+        if sender is not None:
+            conditions.append("people.name = ?")
+            arguments.append(sender)
+        if since_ms is not None:
+            conditions.append("messages.timestamp_ms >= ?")
+            arguments.append(since_ms)
+        if until_ms is not None:
+            conditions.append("messages.timestamp_ms < ?")
+            arguments.append(until_ms)
+        return self.__query("SELECT messages.timestamp_ms, people.name, messages.content FROM messages " \
+            + "JOIN people ON people.id = messages.sender_id" \
+            + (" WHERE " + " AND ".join(conditions) if conditions else "") \
+            + " ORDER BY messages.timestamp_ms, messages.id", arguments)
+
+
+    # [(reaction, count)] of the reactions used by `actor`, most used first
+    def reactions_by_actor(self, actor):
+        return self.__query("SELECT reaction, COUNT(*) AS count FROM reactions " \
+            + "WHERE actor_id = (SELECT id FROM people WHERE name = ?) " \
+            + "GROUP BY reaction ORDER BY count DESC, MIN(rowid)", [actor])
+
+
+    # [(message id, sender, content, num reactions, num distinct reactions, self reacted,
+    # has videos, has photos, has gifs)] of the messages with exactly `num_reactions`
+    # reactions, in chronological order
+    def messages_with_reactions(self, num_reactions):
+        return self.__query("SELECT messages.id, people.name, messages.content, COUNT(*) AS num_reactions, " \
+            + "COUNT(DISTINCT reactions.reaction), MAX(reactions.actor_id = messages.sender_id), " \
+            + "messages.has_videos, messages.has_photos, messages.has_gifs " \
+            + "FROM reactions JOIN messages ON messages.id = reactions.message_id " \
+            + "JOIN people ON people.id = messages.sender_id " \
+            + "GROUP BY reactions.message_id HAVING num_reactions = ? ORDER BY messages.id", [num_reactions])
+
+    # [(actor, sender, count)], actors in order of reactions given, then senders in order
+    # of reactions received from that actor
+    def reactions_to_senders(self):
+        return [row[:3] for row in self.__query("SELECT actors.name, senders.name, COUNT(*) AS count, " \
+            + "SUM(COUNT(*)) OVER (PARTITION BY reactions.actor_id) AS given " \
+            + "FROM reactions JOIN messages ON messages.id = reactions.message_id " \
+            + "JOIN people AS actors ON actors.id = reactions.actor_id " \
+            + "JOIN people AS senders ON senders.id = messages.sender_id " \
+            + "GROUP BY reactions.actor_id, messages.sender_id " \
+            + "ORDER BY given DESC, reactions.actor_id, count DESC, messages.sender_id")]
+
+
+    def __query(self, sql, arguments=()):
+        return self.connection.execute(sql, arguments).fetchall()
+
+    def __query_value(self, sql, arguments=()):
+        row = self.connection.execute(sql, arguments).fetchone()
+        return row[0] if row is not None else None
+
+    def __sender_filter(self, sender):
+        return " WHERE sender_id = (SELECT id FROM people WHERE name = ?)" if sender is not None else ""
+
+    def __sender_arguments(self, sender):
+        return [sender] if sender is not None else []
+
+    def __get_metadata(self, key):
+        try:
+            return self.__query_value("SELECT value FROM metadata WHERE key = ?", [key])
+        except sqlite3.OperationalError:
+            # New database
+            return None
+
+
+# Runs each statement of `script` in the current transaction, unlike executescript,
+# which commits first
+def execute_script(connection, script):
+    for statement in script.split(";"):
+        if statement.strip():
+            connection.execute(statement)
+
+
+# Identifies the messages, their day buckets and the participants, to tell whether a
+# database is stale
+def table_content_hash(table, participants, time_index):
+    content_hash = hashlib.blake2b(digest_size=16)
+    for column in (table.fingerprints, table.timestamps, table.reaction_offsets, table.reaction_actor_codes, \
+            table.reaction_codes, time_index.days):
+        content_hash.update(np.ascontiguousarray(column).tobytes())
+    for strings in (table.names, table.reactions, sorted(participants)):
+        content_hash.update("\0".join(strings).encode("utf8", "surrogatepass"))
+    return content_hash.hexdigest()
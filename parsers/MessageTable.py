@@ -0,0 +1,306 @@
+from parsers.TextColumn import TextColumn
+from parsers.TextNormalizer import repair_mojibake, clean_text
+from profiling.StageProfiler import profiled
+from array import array
+import heapq, hashlib, json
+import numpy as np
+
+
+# JSON field names
+MESSAGE_TYPE = "type"
+MESSAGE_CONTENT = "content"
+TIMESTAMP_MS = "timestamp_ms"
+SENDER_NAME = "sender_name"
+REACTIONS = "reactions"
+REACTION = "reaction"
+ACTOR = "actor"
+VIDEOS = "videos"
+PHOTOS = "photos"
+GIFS = "gifs"
+
+
+"""
+Columnar, NumPy-backed view of a chat, built once by the parser and shared by all
+the analyzers.
+
+Row `i` is the i-th message. Senders, reaction actors, message types and reaction
+strings are stored as integer codes into the `names`, `types` and `reactions` lists,
+which are repaired from Facebook's mojibake. `contents` holds each message's raw text
+(None if it has none), and `clean_contents` the same text normalized once for the
+word clouds; both are TextColumns, decoded row by row when read. The reactions of
+message `i` are the rows `reaction_offsets[i]:reaction_offsets[i + 1]` of
+`reaction_actor_codes` and `reaction_codes`.
+"""
+class MessageTable:
+    # Arrays with one entry per message, and one entry per reaction
+    MESSAGE_COLUMNS = ["timestamps", "sender_codes", "type_codes", "has_content", "has_videos", \
+        "has_photos", "has_gifs", "has_reactions", "fingerprints"]
+    REACTION_COLUMNS = ["reaction_actor_codes", "reaction_codes"]
+    # TextColumns with one entry per message, None for messages without text
+    TEXT_COLUMNS = ["contents", "clean_contents"]
+
+    def __init__(self, timestamps, sender_codes, type_codes, contents, clean_contents, has_content, \
+            has_videos, has_photos, has_gifs, has_reactions, fingerprints, reaction_offsets, \
+            reaction_actor_codes, reaction_codes, names, types, reactions):
+        self.timestamps = timestamps
+        self.sender_codes = sender_codes
+        self.type_codes = type_codes
+        self.contents = contents
+        self.clean_contents = clean_contents
+        self.has_content = has_content
+        self.has_videos = has_videos
+        self.has_photos = has_photos
+        self.has_gifs = has_gifs
+        self.has_reactions = has_reactions
+        self.fingerprints = fingerprints
+        self.reaction_offsets = reaction_offsets
+        self.reaction_actor_codes = reaction_actor_codes
+        self.reaction_codes = reaction_codes
+        self.names = names
+        self.types = types
+        self.reactions = reactions
+        return
+
+
+    # Builds the table from an iterable of message dicts, e.g. the output of
+    # `JsonMessageParser.stream_messages`, without keeping the dicts around.
+    @classmethod
+    def from_messages(cls, messages):
+        names, types, reactions = CategoryEncoder(), CategoryEncoder(), CategoryEncoder()
+        timestamps, sender_codes, type_codes = array("q"), array("l"), array("l")
+        flags = {MESSAGE_CONTENT: array("b"), VIDEOS: array("b"), PHOTOS: array("b"), \
+            GIFS: array("b"), REACTIONS: array("b")}
+        reaction_offsets, reaction_actor_codes, reaction_codes = array("q", [0]), array("l"), array("l")
+        fingerprints = array("Q")
+        contents = []
+
+        for message in messages:
+            timestamps.append(message[TIMESTAMP_MS])
+            sender_codes.append(names.code(message[SENDER_NAME]))
+            type_codes.append(types.code(message[MESSAGE_TYPE]))
+            contents.append(message.get(MESSAGE_CONTENT))
+            for field in flags:
+                flags[field].append(field in message)
+            fingerprints.append(message_fingerprint(message))
+
+            for reaction in message.get(REACTIONS, ()):
+                if ACTOR not in reaction or REACTION not in reaction:
+                    print("Unexpected error: Reaction JSON has no \"actor\" or \"reaction\" field!")
+                    continue
+                reaction_actor_codes.append(names.code(reaction[ACTOR]))
+                reaction_codes.append(reactions.code(reaction[REACTION]))
+            reaction_offsets.append(len(reaction_codes))
+
+        return cls(
+            timestamps=np.array(timestamps, dtype=np.int64),
+            sender_codes=np.array(sender_codes, dtype=np.int32),
+            type_codes=np.array(type_codes, dtype=np.int32),
+            contents=TextColumn.from_strings(contents),
+            clean_contents=TextColumn.from_strings(clean_text(content) if content is not None else None \
+                for content in contents),
+            has_content=np.array(flags[MESSAGE_CONTENT], dtype=bool),
+            has_videos=np.array(flags[VIDEOS], dtype=bool),
+            has_photos=np.array(flags[PHOTOS], dtype=bool),
+            has_gifs=np.array(flags[GIFS], dtype=bool),
+            has_reactions=np.array(flags[REACTIONS], dtype=bool),
+            fingerprints=np.array(fingerprints, dtype=np.uint64),
+            reaction_offsets=np.array(reaction_offsets, dtype=np.int64),
+            reaction_actor_codes=np.array(reaction_actor_codes, dtype=np.int32),
+            reaction_codes=np.array(reaction_codes, dtype=np.int32),
+            names=[repair_mojibake(name) for name in names.values],
+            types=types.values,
+            reactions=[repair_mojibake(reaction) for reaction in reactions.values],
+        )
+
+
+    # Concatenates tables, re-encoding their categories into shared ones
+    @classmethod
+    def concat(cls, tables):
+        if len(tables) == 0:
+            return cls.from_messages([])
+        names, types, reactions = CategoryEncoder(), CategoryEncoder(), CategoryEncoder()
+        def recode(encoder, values, codes):
+            mapping = np.array([encoder.code(v) for v in values] + [0], dtype=np.int32)
+            return mapping[codes]
+
+        columns = {column: [] for column in cls.MESSAGE_COLUMNS + cls.REACTION_COLUMNS}
+        texts = {column: [] for column in cls.TEXT_COLUMNS}
+        reaction_offsets = [np.zeros(1, dtype=np.int64)]
+        for table in tables:
+            for column in cls.MESSAGE_COLUMNS + cls.REACTION_COLUMNS:
+                columns[column].append(getattr(table, column))
+            columns["sender_codes"][-1] = recode(names, table.names, table.sender_codes)
+            columns["type_codes"][-1] = recode(types, table.types, table.type_codes)
+            columns["reaction_actor_codes"][-1] = recode(names, table.names, table.reaction_actor_codes)
+            columns["reaction_codes"][-1] = recode(reactions, table.reactions, table.reaction_codes)
+            reaction_offsets.append(table.reaction_offsets[1:] + reaction_offsets[-1][-1])
+            for column in cls.TEXT_COLUMNS:
+                texts[column].append(getattr(table, column))
+
+        return cls(reaction_offsets=np.concatenate(reaction_offsets), \
+            names=names.values, types=types.values, reactions=reactions.values, \
+            **{column: TextColumn.concat(columns) for column, columns in texts.items()}, \
+            **{column: np.concatenate(arrays) for column, arrays in columns.items()})
+
+
+    # Merges tables that are each sorted by timestamp into one sorted table, with a
+    # heap-based k-way merge. Messages with the same fingerprint as an earlier message
+    # (e.g. from overlapping exports) are dropped.
+    @classmethod
+    @profiled(count=lambda result, cls, tables: sum(len(table) for table in tables))
+    def merge_sorted(cls, tables):
+        combined = cls.concat(tables)
+        starts = np.cumsum([0] + [len(table) for table in tables])
+        timestamps, fingerprints = combined.timestamps.tolist(), combined.fingerprints.tolist()
+        runs = [zip(timestamps[start:end], range(start, end)) for start, end in zip(starts[:-1], starts[1:])]
+
+        # Duplicates share a timestamp, so only fingerprints of the current timestamp are kept
+        indices, current_timestamp, current_fingerprints = [], None, set()
+        for timestamp, index in heapq.merge(*runs):
+            if timestamp != current_timestamp:
+                current_timestamp, current_fingerprints = timestamp, set()
+            if fingerprints[index] in current_fingerprints:
+                continue
+            current_fingerprints.add(fingerprints[index])
+            indices.append(index)
+        return combined.take(np.array(indices, dtype=np.int64))
+
+
+    # Table with only the messages at `indices`, in that order
+    def take(self, indices):
+        counts = self.reaction_counts()[indices]
+        reaction_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(counts, out=reaction_offsets[1:])
+        # Reaction rows of each selected message, laid out back to back
+        reaction_rows = np.repeat(self.reaction_offsets[:-1][indices] - reaction_offsets[:-1], counts) \
+            + np.arange(reaction_offsets[-1])
+
+        columns = {column: getattr(self, column)[indices] for column in self.MESSAGE_COLUMNS}
+        columns.update({column: getattr(self, column)[reaction_rows] for column in self.REACTION_COLUMNS})
+        columns.update({column: getattr(self, column).take(indices) for column in self.TEXT_COLUMNS})
+        return MessageTable(reaction_offsets=reaction_offsets, names=self.names, types=self.types, \
+            reactions=self.reactions, **columns)
+
+
+    # Rows [start, end) as a new table. Unlike `take`, the array columns are views.
+    def slice(self, start, end):
+        reaction_start, reaction_end = int(self.reaction_offsets[start]), int(self.reaction_offsets[end])
+        columns = {column: getattr(self, column)[start:end] for column in self.MESSAGE_COLUMNS}
+        columns.update({column: getattr(self, column)[reaction_start:reaction_end] for column in self.REACTION_COLUMNS})
+        columns.update({column: getattr(self, column)[start:end] for column in self.TEXT_COLUMNS})
+        return MessageTable(reaction_offsets=self.reaction_offsets[start:end + 1] - reaction_start, names=self.names, \
+            types=self.types, reactions=self.reactions, **columns)
+
+
+    # Messages with `since_ms <= timestamp < until_ms`, where either bound can be None.
+    # The table must be sorted by time, e.g. by `merge_sorted`, so that the range is
+    # found by binary search.
+    def time_range(self, since_ms=None, until_ms=None):
+        start = int(np.searchsorted(self.timestamps, since_ms)) if since_ms is not None else 0
+        end = int(np.searchsorted(self.timestamps, until_ms)) if until_ms is not None else len(self)
+        return self.slice(start, max(start, end))
+
+
+    # Flat dict of NumPy arrays holding the whole table, e.g. for `np.savez`. Strings
+    # are stored as one UTF-8 blob per column plus character offsets, and text columns
+    # as one UTF-8 blob plus byte offsets and character lengths.
+    def to_arrays(self):
+        arrays = {column: getattr(self, column) for column in self.MESSAGE_COLUMNS + self.REACTION_COLUMNS}
+        arrays["reaction_offsets"] = self.reaction_offsets
+        for column in ["names", "types", "reactions"]:
+            arrays[column], arrays[column + "_offsets"] = encode_strings(getattr(self, column))
+        for column in self.TEXT_COLUMNS:
+            arrays[column], arrays[column + "_offsets"], arrays[column + "_lengths"] = getattr(self, column).to_arrays()
+        return arrays
+
+
+    # The text blobs can be memory-mapped, in which case they are only read as rows
+    # are decoded
+    @classmethod
+    def from_arrays(cls, arrays):
+        columns = {column: arrays[column] for column in cls.MESSAGE_COLUMNS + cls.REACTION_COLUMNS}
+        for column in ["names", "types", "reactions"]:
+            columns[column] = decode_strings(arrays[column], arrays[column + "_offsets"])
+        for column in cls.TEXT_COLUMNS:
+            columns[column] = TextColumn.from_arrays(arrays[column], arrays[column + "_offsets"], \
+                arrays[column + "_lengths"], columns["has_content"])
+        return cls(reaction_offsets=arrays["reaction_offsets"], **columns)
+
+
+    def sort_by_time(self):
+        return self.take(np.argsort(self.timestamps, kind="stable"))
+
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+    # Returns -1 for a type that never appears in the table
+    def type_code(self, message_type):
+        return self.types.index(message_type) if message_type in self.types else -1
+
+
+    # Number of reactions on each message
+    def reaction_counts(self):
+        return np.diff(self.reaction_offsets)
+
+
+    # Length of each message's text, 0 for messages without text
+    def content_lengths(self):
+        return self.contents.lengths
+
+
+    # Row of the message that each reaction belongs to
+    def reaction_message_indices(self):
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.reaction_counts())
+
+
+"""
+Assigns consecutive integer codes to values in the order they are first seen
+"""
+class CategoryEncoder:
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        return
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+
+# Stable 64-bit identifier of a message. Reactions are left out, so the same message
+# taken from exports downloaded at different times has the same fingerprint.
+def message_fingerprint(message):
+    fields = {key: value for key, value in message.items() if key != REACTIONS}
+    serialized = json.dumps(fields, sort_keys=True, ensure_ascii=False).encode("utf8", "surrogatepass")
+    return int.from_bytes(hashlib.blake2b(serialized, digest_size=8).digest(), "little")
+
+
+def encode_strings(strings):
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum([len(string) for string in strings], out=offsets[1:])
+    blob = "".join(strings).encode("utf8", "surrogatepass")
+    return np.frombuffer(blob, dtype=np.uint8), offsets
+
+
+def decode_strings(blob, offsets):
+    joined = blob.tobytes().decode("utf8", "surrogatepass")
+    offsets = offsets.tolist()
+    return [joined[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+# Vectorized equivalent of `Counter(codes).most_common(limit)`: (code, count) pairs
+# sorted by decreasing count, with ties broken by first occurrence.
+def ranked_counts(codes, limit=None):
+    codes = np.asarray(codes)
+    if len(codes) == 0:
+        return []
+    unique_codes, first_indices, counts = np.unique(codes, return_index=True, return_counts=True)
+    order = np.lexsort((first_indices, -counts))[:limit]
+    return [(int(unique_codes[i]), int(counts[i])) for i in order]
+
@@ -0,0 +1,119 @@
+from parsers.MessageTable import MessageTable, encode_strings, decode_strings
+from profiling.StageProfiler import profiled
+import hashlib, json, os
+import numpy as np
+
+
+MANIFEST_FILENAME = "manifest.json"
+CACHE_FILE_FORMAT = ".npz"
+TEXT_FILE_FORMAT = ".npy"
+# Bump when the MessageTable layout changes, so that old cache files are ignored
+CACHE_VERSION = 3
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Manifest field names
+VERSION = "version"
+FILES = "files"
+SIZE = "size"
+MTIME = "mtime_ns"
+CONTENT_HASH = "content_hash"
+
+
+"""
+On-disk cache of parsed input files. Each input file's MessageTable and participants
+are stored as an uncompressed .npz named after the hash of the file's content, except
+for the text of the messages: each text column is a separate .npy, which is
+memory-mapped on load so that text is only read from disk when it is used. The
+manifest maps each input path to its size, mtime and content hash, so unchanged files
+are recognized without reading them, and touched-but-identical files only need to be
+hashed, not parsed.
+"""
+class ParseCache:
+    def __init__(self, cache_directory_path):
+        self.cache_directory_path = cache_directory_path
+        self.manifest_path = cache_directory_path + MANIFEST_FILENAME
+        self.files = self.__read_manifest()
+        return
+
+
+    # Returns (table, participants) for `filename`, or None if it has to be parsed again
+    @profiled(count=lambda result, self, filename: len(result[0]) if result is not None else 0)
+    def load(self, filename):
+        key, stat = os.path.abspath(filename), os.stat(filename)
+        entry = self.files.get(key)
+        if entry is None:
+            return None
+        if entry[SIZE] != stat.st_size or entry[MTIME] != stat.st_mtime_ns:
+            if entry[SIZE] != stat.st_size or entry[CONTENT_HASH] != file_content_hash(filename):
+                return None
+            entry[MTIME] = stat.st_mtime_ns
+
+        cache_file_paths = self.__cache_file_paths(entry[CONTENT_HASH])
+        if not all(os.path.exists(path) for path in cache_file_paths):
+            return None
+        with np.load(cache_file_paths[0]) as cache_file:
+            arrays = dict(cache_file)
+        for column, path in zip(MessageTable.TEXT_COLUMNS, cache_file_paths[1:]):
+            arrays[column] = np.load(path, mmap_mode="r")
+        participants = set(decode_strings(arrays["participants"], arrays["participants_offsets"]))
+        return MessageTable.from_arrays(arrays), participants
+
+
+    @profiled(count=lambda result, self, filename, table, participants: len(table))
+    def store(self, filename, table, participants):
+        if not os.path.exists(self.cache_directory_path):
+            os.makedirs(self.cache_directory_path)
+        key, stat = os.path.abspath(filename), os.stat(filename)
+        content_hash = file_content_hash(filename)
+
+        arrays = table.to_arrays()
+        arrays["participants"], arrays["participants_offsets"] = encode_strings(sorted(participants))
+        cache_file_paths = self.__cache_file_paths(content_hash)
+        for column, path in zip(MessageTable.TEXT_COLUMNS, cache_file_paths[1:]):
+            np.save(path, arrays.pop(column))
+        np.savez(cache_file_paths[0], **arrays)
+
+        previous_entry = self.files.get(key)
+        self.files[key] = {SIZE: stat.st_size, MTIME: stat.st_mtime_ns, CONTENT_HASH: content_hash}
+        if previous_entry is not None:
+            self.__remove_if_unused(previous_entry[CONTENT_HASH])
+
+
+    def write_manifest(self):
+        if not os.path.exists(self.cache_directory_path):
+            os.makedirs(self.cache_directory_path)
+        with open(self.manifest_path, "w") as manifest_file:
+            json.dump({VERSION: CACHE_VERSION, FILES: self.files}, manifest_file, indent=1)
+
+
+    def __read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get(VERSION) != CACHE_VERSION:
+            return {}
+        return manifest[FILES]
+
+
+    # The .npz, then the text file of each of MessageTable.TEXT_COLUMNS
+    def __cache_file_paths(self, content_hash):
+        return [self.cache_directory_path + content_hash + CACHE_FILE_FORMAT] \
+            + [self.cache_directory_path + content_hash + "." + column + TEXT_FILE_FORMAT \
+                for column in MessageTable.TEXT_COLUMNS]
+
+
+    def __remove_if_unused(self, content_hash):
+        if any(entry[CONTENT_HASH] == content_hash for entry in self.files.values()):
+            return
+        for path in self.__cache_file_paths(content_hash):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def file_content_hash(filename):
+    content_hash = hashlib.blake2b(digest_size=16)
+    with open(filename, "rb") as input_file:
+        for chunk in iter(lambda: input_file.read(HASH_CHUNK_SIZE), b""):
+            content_hash.update(chunk)
+    return content_hash.hexdigest()
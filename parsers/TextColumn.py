@@ -0,0 +1,106 @@
+import numpy as np
+
+
+# Exports can contain lone surrogates, which plain UTF-8 refuses to encode
+TEXT_ENCODING = "utf8"
+TEXT_ERRORS = "surrogatepass"
+
+
+"""
+Column of optional strings, one per message, kept as UTF-8 bytes and only decoded
+when a row is read.
+
+Row `i` is the bytes `starts[i]:ends[i]` of `blobs[sources[i]]`, or None where
+`sources[i]` is -1. Blobs are NumPy byte arrays, memory-mapped when the column comes
+from the parse cache, and `take`, slicing and `concat` only move the index arrays,
+never the bytes. A table loaded from the cache therefore reads none of its text
+until an analyzer asks for it, and stages that only use counts never do. `lengths`
+are the rows' lengths in characters, known without decoding.
+"""
+class TextColumn:
+    def __init__(self, blobs, sources, starts, ends, lengths):
+        self.blobs = blobs
+        self.sources = sources
+        self.starts = starts
+        self.ends = ends
+        self.lengths = lengths
+        return
+
+
+    @classmethod
+    def from_strings(cls, strings):
+        strings = list(strings)
+        encoded = [string.encode(TEXT_ENCODING, TEXT_ERRORS) if string is not None else b"" for string in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(text) for text in encoded], out=offsets[1:])
+        return cls(
+            blobs=[np.frombuffer(b"".join(encoded), dtype=np.uint8)],
+            sources=np.array([0 if string is not None else -1 for string in strings], dtype=np.int32),
+            starts=offsets[:-1],
+            ends=offsets[1:],
+            lengths=np.array([len(string) if string is not None else 0 for string in strings], dtype=np.int64),
+        )
+
+
+    # Column of the rows stored back to back in `blob` (e.g. by `to_arrays`), where
+    # `offsets` are byte offsets and rows without `present` set are None
+    @classmethod
+    def from_arrays(cls, blob, offsets, lengths, present):
+        return cls([blob], np.where(present, 0, -1).astype(np.int32), offsets[:-1], offsets[1:], lengths)
+
+
+    # Concatenates columns without copying their text
+    @classmethod
+    def concat(cls, columns):
+        blobs, sources = [], []
+        for column in columns:
+            sources.append(np.where(column.sources >= 0, column.sources + len(blobs), -1).astype(np.int32))
+            blobs += column.blobs
+        return cls(blobs, np.concatenate(sources), np.concatenate([column.starts for column in columns]), \
+            np.concatenate([column.ends for column in columns]), np.concatenate([column.lengths for column in columns]))
+
+
+    # (blob, byte offsets, lengths) with the text of every row back to back, None
+    # rows being empty, e.g. to be stored and read back with `from_arrays`
+    def to_arrays(self):
+        sizes = np.where(self.sources >= 0, self.ends - self.starts, 0)
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=offsets[1:])
+        blob = np.empty(offsets[-1], dtype=np.uint8)
+        for source, source_blob in enumerate(self.blobs):
+            rows = np.flatnonzero((self.sources == source) & (sizes > 0))
+            blob[concatenated_ranges(offsets[rows], sizes[rows])] = \
+                source_blob[concatenated_ranges(self.starts[rows], sizes[rows])]
+        return blob, offsets, self.lengths
+
+
+    # Column with only the rows at `indices`, in that order
+    def take(self, indices):
+        return TextColumn(self.blobs, self.sources[indices], self.starts[indices], self.ends[indices], \
+            self.lengths[indices])
+
+
+    def __len__(self):
+        return len(self.sources)
+
+
+    # A row's text, or a TextColumn for a slice
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return TextColumn(self.blobs, self.sources[key], self.starts[key], self.ends[key], self.lengths[key])
+        source = self.sources[key]
+        if source < 0:
+            return None
+        return self.blobs[source][self.starts[key]:self.ends[key]].tobytes().decode(TEXT_ENCODING, TEXT_ERRORS)
+
+
+    def __iter__(self):
+        for source, start, end in zip(self.sources.tolist(), self.starts.tolist(), self.ends.tolist()):
+            yield self.blobs[source][start:end].tobytes().decode(TEXT_ENCODING, TEXT_ERRORS) if source >= 0 else None
+
+
+# Indices of the ranges [starts[i], starts[i] + sizes[i]), laid out back to back
+def concatenated_ranges(starts, sizes):
+    range_starts = np.zeros(len(sizes), dtype=np.int64)
+    np.cumsum(sizes[:-1], out=range_starts[1:])
+    return np.repeat(starts - range_starts, sizes) + np.arange(range_starts[-1] + sizes[-1] if len(sizes) else 0)
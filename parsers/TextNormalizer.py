@@ -0,0 +1,34 @@
+import string, re
+
+
+# Facebook exports encode text as UTF-8 bytes escaped as latin1 code points,
+# e.g. "donâ\u0080\u0099t" for "don’t"
+MOJIBAKE_ENCODING = "latin1"
+
+# Characters that WordCloud can't use: double quotes are dropped, and curly
+# apostrophes become plain ones because WordCloud only keeps words with contractions
+# when the apostrophe is "'"
+CLEAN_TEXT_TRANSLATION = str.maketrans({"’": "'", '"': None})
+# Same, for ASCII text, where the only other characters to drop are unprintable ones
+CLEAN_ASCII_TRANSLATION = str.maketrans(dict(
+    [(chr(c), None) for c in range(128) if chr(c) not in string.printable] + [('"', None)]))
+# Emojis and other symbols: anything that isn't a word character, whitespace or printable ASCII
+NON_TEXT_CHARACTERS = re.compile("[^\\w\\s" + re.escape(string.printable) + "]+")
+
+
+# Undoes Facebook's latin1/UTF-8 mojibake. Text that isn't mojibake is returned as is.
+def repair_mojibake(text):
+    if text.isascii():
+        return text
+    try:
+        return text.encode(MOJIBAKE_ENCODING).decode("utf8")
+    except UnicodeError:
+        return text
+
+
+# Text of a message as it is fed to the word clouds: repaired, without emojis, symbols
+# and double quotes
+def clean_text(text):
+    if text.isascii():
+        return text.translate(CLEAN_ASCII_TRANSLATION)
+    return NON_TEXT_CHARACTERS.sub("", repair_mojibake(text).translate(CLEAN_TEXT_TRANSLATION))
@@ -0,0 +1,139 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+import numpy as np
+
+
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+
+"""
+Calendar buckets of every message, computed once with NumPy and shared by all the
+analyzers, instead of calling `datetime.fromtimestamp` per message in every stage.
+
+`days`, `months` and `years` are datetime64 arrays in local time, and `day_ids`,
+`month_ids` and `year_ids` are the same buckets as integers counted from the
+earliest one, ready for `np.bincount`.
+
+`timezone_name` is an IANA name such as "America/Los_Angeles". By default the
+system's local timezone is used, like `datetime.fromtimestamp`.
+"""
+class TimeIndex:
+    def __init__(self, timestamps, timezone_name=None):
+        self.tz = ZoneInfo(timezone_name) if timezone_name else None
+        local_timestamps = timestamps + self.__utc_offsets_ms(timestamps)
+
+        self.days = (local_timestamps // MS_PER_DAY).astype("datetime64[D]")
+        self.months = self.days.astype("datetime64[M]")
+        self.years = self.days.astype("datetime64[Y]")
+
+        self.first_day, self.day_ids, self.num_days = self.__bucket_ids(self.days)
+        self.first_month, self.month_ids, self.num_months = self.__bucket_ids(self.months)
+        self.first_year, self.year_ids, self.num_years = self.__bucket_ids(self.years)
+
+        # Running totals of messages, so that `day_prefix_sums[j] - day_prefix_sums[i]`
+        # is the number of messages in days [i, j). Built by the first range query.
+        self.day_prefix_sums = None
+        self.month_prefix_sums = None
+        return
+
+
+    # Number of messages in each bucket, optionally only counting rows where `mask` is set
+    def count_per_day(self, mask=None):
+        return self.__count(self.day_ids, self.num_days, mask)
+
+    def count_per_month(self, mask=None):
+        return self.__count(self.month_ids, self.num_months, mask)
+
+    def count_per_year(self, mask=None):
+        return self.__count(self.year_ids, self.num_years, mask)
+
+
+    # Number of messages from `since` to `until` (exclusive), in O(1) after the first
+    # query. Bounds are dates (or months for `count_between_months`), and None means
+    # unbounded. Only the messages this index was built from are counted, e.g. those
+    # of the --since/--until window.
+    def count_between_days(self, since=None, until=None):
+        if self.day_prefix_sums is None:
+            self.day_prefix_sums = prefix_sums(self.count_per_day())
+        return self.__count_between(self.day_prefix_sums, self.first_day, "D", since, until)
+
+    def count_between_months(self, since=None, until=None):
+        if self.month_prefix_sums is None:
+            self.month_prefix_sums = prefix_sums(self.count_per_month())
+        return self.__count_between(self.month_prefix_sums, self.first_month, "M", since, until)
+
+
+    # Bucket ids back to calendar values
+    def day_at(self, day_id):
+        return (self.first_day + day_id).astype(object)
+
+    def month_at(self, month_id):
+        return (self.first_month + month_id).astype("datetime64[D]").astype(object)
+
+    def year_at(self, year_id):
+        return int((self.first_year + year_id).astype(int)) + 1970
+
+
+    # Bucket ids of data that is already aggregated per day
+    def month_ids_of_days(self, day_ids):
+        return ((self.first_day + day_ids).astype("datetime64[M]") - self.first_month).astype(np.int64)
+
+    def year_ids_of_days(self, day_ids):
+        return ((self.first_day + day_ids).astype("datetime64[Y]") - self.first_year).astype(np.int64)
+
+
+    def __count(self, bucket_ids, num_buckets, mask):
+        if mask is not None:
+            bucket_ids = bucket_ids[mask]
+        return np.bincount(bucket_ids, minlength=num_buckets)
+
+
+    def __count_between(self, sums, first_bucket, unit, since, until):
+        num_buckets = len(sums) - 1
+        def bucket_id(bound, default):
+            if bound is None:
+                return default
+            return min(max(int((np.datetime64(bound, unit) - first_bucket).astype(np.int64)), 0), num_buckets)
+        start, end = bucket_id(since, 0), bucket_id(until, num_buckets)
+        return int(sums[end] - sums[start]) if end > start else 0
+
+
+    def __bucket_ids(self, buckets):
+        if len(buckets) == 0:
+            return np.datetime64(0, np.datetime_data(buckets.dtype)[0]), np.zeros(0, dtype=np.int64), 0
+        first_bucket = buckets.min()
+        bucket_ids = (buckets - first_bucket).astype(np.int64)
+        return first_bucket, bucket_ids, int(bucket_ids.max()) + 1
+
+
+    # Offset from UTC of each timestamp. It is computed once per UTC day, and per
+    # message only on days where the offset changes (e.g. daylight saving time).
+    def __utc_offsets_ms(self, timestamps):
+        utc_days, day_indices = np.unique(timestamps // MS_PER_DAY, return_inverse=True)
+        start_offsets = np.array([self.__utc_offset_ms(day * MS_PER_DAY) for day in utc_days.tolist()], dtype=np.int64)
+        end_offsets = np.array([self.__utc_offset_ms((day + 1) * MS_PER_DAY - 1) for day in utc_days.tolist()], dtype=np.int64)
+
+        offsets = start_offsets[day_indices]
+        for day_index in np.flatnonzero(start_offsets != end_offsets).tolist():
+            rows = np.flatnonzero(day_indices == day_index)
+            offsets[rows] = [self.__utc_offset_ms(t) for t in timestamps[rows].tolist()]
+        return offsets
+
+
+    def __utc_offset_ms(self, timestamp):
+        local_time = datetime.fromtimestamp(timestamp / 1000, timezone.utc).astimezone(self.tz)
+        return int(local_time.utcoffset().total_seconds() * 1000)
+
+
+def prefix_sums(counts):
+    sums = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=sums[1:])
+    return sums
+
+
+# Timestamp of midnight at the start of `day` (a date) in the given IANA timezone, or
+# in local time if `timezone_name` is None
+def day_start_ms(day, timezone_name=None):
+    tz = ZoneInfo(timezone_name) if timezone_name else None
+    start = datetime(day.year, day.month, day.day, tzinfo=tz)
+    return int(start.timestamp() * 1000)
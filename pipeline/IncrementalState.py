@@ -0,0 +1,111 @@
+import hashlib, os, pickle
+import numpy as np
+
+
+STATE_DIRECTORY = "state/"
+STATE_FILE_FORMAT = ".pickle"
+# Bump when the layout of any saved analysis changes, so that old state is ignored
+STATE_VERSION = 1
+
+# State field names
+VERSION = "version"
+KEY = "key"
+WATERMARK = "watermark"
+VALUE = "value"
+
+# Watermark field names
+NUM_MESSAGES = "num_messages"
+LAST_TIMESTAMP = "last_timestamp"
+PREFIX_HASH = "prefix_hash"
+CATEGORIES = "categories"
+
+
+"""
+Result of an analysis of a MessageTable (e.g. a StatisticsAggregate), saved in the
+cache directory so that the next run only analyzes the messages added since and
+folds them in, instead of starting over.
+
+The saved result comes with a watermark: the number of messages it covers, the
+timestamp of the last one, and a hash of those messages. When the new table starts
+with exactly these messages, with the same name, type and reaction codes, only the
+rows after the watermark are analyzed and merged into the saved result. Anything
+else, e.g. an export that adds messages before the watermark or new reactions on
+old messages, starts over from the whole table. `key` holds whatever else the
+result depends on, such as the timezone, and starts over when it changes.
+"""
+class IncrementalState:
+    def __init__(self, cache_directory_path, name, key):
+        self.state_directory_path = cache_directory_path + STATE_DIRECTORY
+        self.state_path = self.state_directory_path + name + STATE_FILE_FORMAT
+        self.key = key
+        return
+
+
+    # Result for the whole `table`. `analyze(start)` analyzes the rows from `start` on,
+    # and `merge(earlier, later)` combines the results of consecutive rows.
+    def update(self, table, analyze, merge):
+        state = self.__read_state()
+        start = 0
+        if state is not None and state[KEY] == self.key and is_prefix(state[WATERMARK], table):
+            start = state[WATERMARK][NUM_MESSAGES]
+        value = analyze(start) if start == 0 else merge(state[VALUE], analyze(start))
+        if start == 0 or start < len(table):
+            self.__write_state(value, watermark(table))
+        return value
+
+
+    def __read_state(self):
+        if not os.path.exists(self.state_path):
+            return None
+        try:
+            with open(self.state_path, "rb") as state_file:
+                state = pickle.load(state_file)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            # Unreadable or written by another version of the code
+            return None
+        return state if state.get(VERSION) == STATE_VERSION else None
+
+
+    # Written to a temporary file first, so that an interrupted run leaves the previous state
+    def __write_state(self, value, table_watermark):
+        if not os.path.exists(self.state_directory_path):
+            os.makedirs(self.state_directory_path)
+        temporary_path = self.state_path + "." + str(os.getpid())
+        with open(temporary_path, "wb") as state_file:
+            pickle.dump({VERSION: STATE_VERSION, KEY: self.key, WATERMARK: table_watermark, VALUE: value}, \
+                state_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, self.state_path)
+
+
+def watermark(table):
+    return {
+        NUM_MESSAGES: len(table),
+        LAST_TIMESTAMP: int(table.timestamps[-1]) if len(table) else None,
+        PREFIX_HASH: prefix_hash(table, len(table)),
+        CATEGORIES: [table.names, table.types, table.reactions],
+    }
+
+
+# Whether `table` starts with the messages under `table_watermark`, with the same codes
+def is_prefix(table_watermark, table):
+    num_messages = table_watermark[NUM_MESSAGES]
+    if num_messages > len(table):
+        return False
+    if num_messages and int(table.timestamps[num_messages - 1]) != table_watermark[LAST_TIMESTAMP]:
+        return False
+    for categories, table_categories in zip(table_watermark[CATEGORIES], [table.names, table.types, table.reactions]):
+        if table_categories[:len(categories)] != categories:
+            return False
+    return prefix_hash(table, num_messages) == table_watermark[PREFIX_HASH]
+
+
+# Hash of the first `num_messages` messages of `table` and of their reactions.
+# Fingerprints cover everything else about a message.
+def prefix_hash(table, num_messages):
+    num_reactions = int(table.reaction_offsets[num_messages])
+    content_hash = hashlib.blake2b(digest_size=16)
+    for column in (table.fingerprints[:num_messages], table.timestamps[:num_messages], \
+            table.sender_codes[:num_messages], table.reaction_offsets[:num_messages + 1], \
+            table.reaction_actor_codes[:num_reactions], table.reaction_codes[:num_reactions]):
+        content_hash.update(np.ascontiguousarray(column).tobytes())
+    return content_hash.hexdigest()
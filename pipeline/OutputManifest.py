@@ -0,0 +1,117 @@
+from contextlib import contextmanager
+import hashlib, json, os
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Not on Windows, where concurrent stages could lose each other's entries
+    fcntl = None
+
+
+MANIFEST_FILENAME = "manifest.json"
+LOCK_FILENAME = ".manifest.lock"
+# Bump when the way any output is rendered changes, so that every output is redone
+MANIFEST_VERSION = 1
+
+# Manifest field names
+VERSION = "version"
+OUTPUTS = "outputs"
+
+
+"""
+Manifest of the rendered outputs (graphs, word clouds...) in an output directory,
+mapping each file to the key it was rendered from. A key is a hash of everything
+that determines the file, i.e. the plotted data and the render parameters (see
+`output_key`), so an output whose key hasn't changed since the last run is already
+on disk and doesn't need to be rendered again.
+
+Paths are relative to the output directory. The stages that write outputs run in
+separate processes, so `write` merges this manifest's entries into the file under a
+lock instead of overwriting it.
+"""
+class OutputManifest:
+    # With `enabled=False` nothing is ever current, so everything is rendered again
+    def __init__(self, output_directory_path, enabled=True):
+        self.output_directory_path = output_directory_path
+        self.manifest_path = output_directory_path + MANIFEST_FILENAME
+        self.enabled = enabled
+        self.outputs = self.__read_manifest() if enabled else {}
+        # Entries recorded since the last write
+        self.recorded = {}
+        return
+
+
+    # Whether all of `paths` exist and were rendered from `key`
+    def is_current(self, paths, key):
+        return self.enabled and all(self.outputs.get(path) == key \
+            and os.path.exists(self.output_directory_path + path) for path in paths)
+
+
+    # Records that `paths` were rendered from `key`, once they are written
+    def record(self, paths, key):
+        for path in paths:
+            self.outputs[path] = key
+            self.recorded[path] = key
+
+
+    def write(self):
+        if not self.recorded:
+            return
+        if not os.path.exists(self.output_directory_path):
+            os.makedirs(self.output_directory_path)
+        with self.__lock():
+            outputs = self.__read_manifest()
+            outputs.update(self.recorded)
+            temporary_path = self.manifest_path + "." + str(os.getpid())
+            with open(temporary_path, "w") as manifest_file:
+                json.dump({VERSION: MANIFEST_VERSION, OUTPUTS: dict(sorted(outputs.items()))}, manifest_file, \
+                    indent=1, ensure_ascii=False)
+            os.replace(temporary_path, self.manifest_path)
+        self.recorded = {}
+
+
+    def __read_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get(VERSION) != MANIFEST_VERSION:
+            return {}
+        return manifest[OUTPUTS]
+
+
+    @contextmanager
+    def __lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.output_directory_path + LOCK_FILENAME, "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+# Hash of `parts`, which can be NumPy arrays, JSON-like values (tuples, dicts, NumPy
+# scalars...), functions (by name) or objects (by their attributes)
+def output_key(*parts):
+    key = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            key.update((str(part.dtype) + str(part.shape)).encode("utf8"))
+            key.update(np.ascontiguousarray(part).tobytes())
+        else:
+            key.update(json.dumps(part, sort_keys=True, ensure_ascii=False, default=json_key_value) \
+                .encode("utf8", "surrogatepass"))
+        key.update(b"\0")
+    return key.hexdigest()
+
+
+def json_key_value(value):
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    if callable(value):
+        return value.__module__ + "." + value.__qualname__
+    return vars(value)
@@ -0,0 +1,153 @@
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from profiling.StageProfiler import PROFILER
+import multiprocessing, os, sys
+
+
+# Stages and data handed to the worker processes. With the "fork" start method the
+# workers inherit them from the parent, so the message table is never pickled.
+SHARED_STAGES = {}
+SHARED_DATA = {}
+
+
+"""
+A step of the pipeline. `function` is called with the data named in `requires` as
+keyword arguments, and returns a dict with the data named in `produces` (or None if
+it produces nothing). Stages with `parallel=False` always run in the main process,
+e.g. cheap stages whose output is large and would be expensive to send back.
+"""
+class Stage:
+    def __init__(self, name, function, requires=(), produces=(), parallel=True):
+        self.name = name
+        self.function = function
+        self.requires = list(requires)
+        self.produces = list(produces)
+        self.parallel = parallel
+        return
+
+    def run(self, data):
+        print(self.name + "...")
+        with PROFILER.measure(self.name, cprofile=True) as profile:
+            produced = self.function(**{name: data[name] for name in self.requires}) or {}
+            table = produced.get("table", data.get("table"))
+            profile["messages"] = len(table) if table is not None else None
+        missing = set(self.produces) - set(produced)
+        if missing:
+            raise ValueError("Stage \"" + self.name + "\" did not produce " + ", ".join(sorted(missing)))
+        return produced
+
+
+"""
+Runs stages in dependency order. Each stage starts as soon as everything it requires
+has been produced, rather than waiting for unrelated stages, so the wall time is
+close to that of the longest chain of dependent stages. Parallel stages run in
+worker processes of their own, at most `num_workers` at a time, while the main
+process runs the others.
+"""
+class StageScheduler:
+    # `num_workers` defaults to the number of CPUs
+    def __init__(self, stages, num_workers=None):
+        self.stages = stages
+        self.num_workers = num_workers or os.cpu_count() or 1
+        # Pool of each stage running in a worker process
+        self.pools = {}
+        return
+
+
+    def run(self, data=None):
+        data = dict(data or {})
+        self.__check_requirements(data)
+        waiting = list(self.stages)
+        # Stage of each future running in a worker process
+        running = {}
+        try:
+            while waiting or running:
+                ready = [stage for stage in waiting if set(stage.requires) <= set(data)]
+                # Worker stages start first, so that they run while the main process is busy
+                for stage in ready:
+                    if stage.parallel and 1 < self.num_workers and len(running) < self.num_workers:
+                        waiting.remove(stage)
+                        running[self.__submit(stage, data)] = stage
+                main_stages = [stage for stage in ready if not stage.parallel or self.num_workers == 1]
+                if main_stages:
+                    waiting.remove(main_stages[0])
+                    data.update(main_stages[0].run(data))
+                    continue
+
+                done, not_done = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    self.pools.pop(stage.name).shutdown()
+                    stage_produced, profile_records = future.result()
+                    data.update(stage_produced)
+                    PROFILER.add_records(profile_records)
+        finally:
+            for pool in self.pools.values():
+                pool.shutdown(cancel_futures=True)
+            self.pools.clear()
+            SHARED_STAGES.clear()
+            SHARED_DATA.clear()
+        return data
+
+
+    # Starts `stage` in a single-worker pool of its own. With fork, the worker inherits
+    # the data produced so far; otherwise it receives only the data the stage requires.
+    def __submit(self, stage, data):
+        if multiprocessing.get_start_method() == "fork":
+            SHARED_STAGES[stage.name] = stage
+            SHARED_DATA.update(data)
+            context, initargs = multiprocessing.get_context("fork"), (PROFILER.settings(),)
+        else:
+            context, initargs = multiprocessing.get_context(), \
+                (PROFILER.settings(), {stage.name: stage}, {name: data[name] for name in stage.requires})
+        pool = ProcessPoolExecutor(1, mp_context=context, initializer=initialize_worker, initargs=initargs)
+        self.pools[stage.name] = pool
+        return pool.submit(run_shared_stage, stage.name)
+
+
+    # Raises if some stage requires data that is neither given nor produced by a stage
+    # that can run
+    def __check_requirements(self, data):
+        available = set(data)
+        remaining = list(self.stages)
+        while remaining:
+            runnable = [stage for stage in remaining if set(stage.requires) <= available]
+            if not runnable:
+                missing = set().union(*[stage.requires for stage in remaining]) - available
+                raise ValueError("No stage produces " + ", ".join(sorted(missing)))
+            for stage in runnable:
+                available |= set(stage.produces)
+                remaining.remove(stage)
+
+
+# Returns the stages named in `names`, and the stages that produce the data they need
+# (directly or not), in their original order
+def select_stages(stages, names):
+    producers = {name: stage for stage in stages for name in stage.produces}
+    selected = []
+    pending = [stage for stage in stages if stage.name in names]
+    while pending:
+        stage = pending.pop()
+        if stage in selected:
+            continue
+        selected.append(stage)
+        pending += [producers[name] for name in stage.requires if name in producers]
+    return [stage for stage in stages if stage in selected]
+
+
+def initialize_worker(profiler_settings, stages=None, data=None):
+    if stages is not None:
+        SHARED_STAGES.update(stages)
+        SHARED_DATA.update(data)
+    # Forked workers inherit the parent's records, which are reported by the parent
+    PROFILER.configure(**profiler_settings)
+    # Workers only render to files, and must not open GUI windows. matplotlib is only
+    # imported by the stages that need it.
+    if "matplotlib" in sys.modules:
+        sys.modules["matplotlib"].use("Agg")
+    else:
+        os.environ["MPLBACKEND"] = "Agg"
+
+
+# Returns the stage's data along with the profile records made while running it
+def run_shared_stage(name):
+    return SHARED_STAGES[name].run(SHARED_DATA), PROFILER.take_records()
@@ -0,0 +1,178 @@
+from contextlib import contextmanager
+import cProfile, functools, json, os, re, sys, time, tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows, where the peak resident memory isn't reported
+    resource = None
+
+
+PROFILE_FILENAME = "profile.json"
+CPROFILE_DIRECTORY = "profile/"
+CPROFILE_FILE_FORMAT = ".prof"
+
+
+"""
+Records wall time, CPU time, peak memory and the number of messages processed for
+every pipeline stage and every instrumented step inside it (see `profiled`).
+
+Profiling is off by default and costs one attribute check per instrumented call.
+Once enabled, tracemalloc runs for the whole process, and the peak of each step is
+also counted in the peak of the step or stage that contains it. Records made in
+worker processes (the scheduler's, and the parser's) are sent back with their results
+and added with `add_records`.
+"""
+class StageProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.cprofile_directory_path = None
+        self.records = []
+        self.stack = []
+        return
+
+
+    def enable(self, cprofile_directory_path=None):
+        self.enabled = True
+        self.cprofile_directory_path = cprofile_directory_path
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+    # Settings to re-create this profiler in a worker process
+    def settings(self):
+        return {"enabled": self.enabled, "cprofile_directory_path": self.cprofile_directory_path}
+
+    def configure(self, enabled, cprofile_directory_path):
+        self.records, self.stack = [], []
+        if enabled:
+            self.enable(cprofile_directory_path)
+
+
+    # Removes and returns the records made so far
+    def take_records(self):
+        records, self.records = self.records, []
+        return records
+
+    # Records of a worker process. Its top-level records are nested in the step or stage
+    # running here, if any, which is the one that waited for them.
+    def add_records(self, records):
+        parent = self.stack[-1]["name"] if self.stack else None
+        self.records += [dict(record, parent=record["parent"] or parent) for record in records]
+
+
+    # Measures the code in the `with` block. `cprofile` also dumps a cProfile of the
+    # block, if a cProfile directory was given. The block can set the number of
+    # messages once it is known, through the "messages" key of the yielded dict.
+    @contextmanager
+    def measure(self, name, messages=None, cprofile=False):
+        if not self.enabled:
+            yield {}
+            return
+
+        parent = self.stack[-1] if self.stack else None
+        frame = {"name": name, "peak": 0, "messages": messages}
+        self.stack.append(frame)
+        if parent is not None:
+            # Remember the peak so far, since the peak counter is shared
+            parent["peak"] = max(parent["peak"], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        start_traced = tracemalloc.get_traced_memory()[0]
+
+        profile = cProfile.Profile() if cprofile and self.cprofile_directory_path else None
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        if profile:
+            profile.enable()
+        try:
+            yield frame
+        finally:
+            if profile:
+                profile.disable()
+                self.__dump_cprofile(name, profile)
+            wall_seconds, cpu_seconds = time.perf_counter() - wall_start, time.process_time() - cpu_start
+            frame["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+            self.stack.pop()
+            if parent is not None:
+                parent["peak"] = max(parent["peak"], frame["peak"])
+
+            self.records.append({
+                "name": name,
+                "parent": parent["name"] if parent is not None else None,
+                "wall_seconds": wall_seconds,
+                "cpu_seconds": cpu_seconds,
+                "peak_traced_bytes": max(frame["peak"] - start_traced, 0),
+                "max_rss_bytes": max_rss_bytes(),
+                "messages": frame["messages"],
+                "pid": os.getpid(),
+            })
+
+
+    # Writes the records, with repeated steps (e.g. one per input file) combined: their
+    # times and numbers of messages are added up
+    def write_report(self, output_directory_path):
+        combined = {}
+        for record in self.records:
+            key = (record["parent"], record["name"])
+            if key not in combined:
+                combined[key] = dict(record, calls=0, wall_seconds=0, cpu_seconds=0)
+            entry = combined[key]
+            entry["calls"] += 1
+            entry["wall_seconds"] += record["wall_seconds"]
+            entry["cpu_seconds"] += record["cpu_seconds"]
+            if entry["calls"] > 1 and record["messages"] is not None:
+                entry["messages"] = (entry["messages"] or 0) + record["messages"]
+            entry["peak_traced_bytes"] = max(entry["peak_traced_bytes"], record["peak_traced_bytes"])
+            if record["max_rss_bytes"] is not None:
+                entry["max_rss_bytes"] = max(entry["max_rss_bytes"] or 0, record["max_rss_bytes"])
+        for entry in combined.values():
+            entry["wall_seconds"] = round(entry["wall_seconds"], 4)
+            entry["cpu_seconds"] = round(entry["cpu_seconds"], 4)
+
+        with open(output_directory_path + PROFILE_FILENAME, "w") as profile_file:
+            json.dump({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "records": list(combined.values())}, \
+                profile_file, indent=2)
+        return list(combined.values())
+
+
+    def __dump_cprofile(self, name, profile):
+        if not os.path.exists(self.cprofile_directory_path):
+            os.makedirs(self.cprofile_directory_path)
+        filename = re.sub(r"[^\w.-]+", "_", name).strip("_").lower()
+        profile.dump_stats(self.cprofile_directory_path + filename + CPROFILE_FILE_FORMAT)
+
+
+PROFILER = StageProfiler()
+
+
+# Decorator that measures every call of a function or method with PROFILER, used as
+# `@profiled` or `@profiled(count=...)`. `count(result, *args, **kwargs)` returns the
+# number of messages a call processed, from its result and arguments. By default it
+# is the length of the first argument that has a `timestamps` column.
+def profiled(function=None, count=None):
+    if function is None:
+        return functools.partial(profiled, count=count)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not PROFILER.enabled:
+            return function(*args, **kwargs)
+        with PROFILER.measure(function.__qualname__) as frame:
+            result = function(*args, **kwargs)
+            frame["messages"] = count(result, *args, **kwargs) if count is not None \
+                else next((len(arg.timestamps) for arg in args if hasattr(arg, "timestamps")), None)
+            return result
+    return wrapper
+
+
+# `count` of the steps of an analyzer or generator that sets `self.num_messages` to
+# the number of messages it summarizes
+def instance_messages(result, self, *args, **kwargs):
+    return self.num_messages
+
+
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS. None on Windows.
+def max_rss_bytes():
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
@@ -0,0 +1,178 @@
+from parsers.MessageTable import CategoryEncoder
+from wordcloud import STOPWORDS
+from wordcloud.tokenization import score
+from collections import defaultdict
+from array import array
+import numpy as np
+import re
+
+
+GENERIC_MESSAGE_TYPE = "Generic"
+EXCLUDE_CALL_JOINED = "joined the video chat."
+
+# Same tokenization settings as WordCloud's defaults
+TOKEN_PATTERN = re.compile(r"\w[\w']*")
+LOWERCASE_STOPWORDS = set(word.lower() for word in STOPWORDS)
+COLLOCATION_THRESHOLD = 30
+
+
+"""
+Word counts of every message, computed in a single tokenization pass and stored
+sparsely per (day, person, term), so that every word cloud is a sum over a slice of
+the cube instead of re-tokenizing the joined text of its messages.
+
+The terms are the words and two-word phrases that WordCloud itself would count
+(same pattern, stopwords, "'s" and number removal). `frequencies` then applies
+WordCloud's case folding, plural merging and collocation detection to the summed
+counts of a slice. Any grouping of days (years, months, weekdays...) can be sliced
+without tokenizing again, and the cubes of earlier and later messages can be merged,
+so that new messages are counted without tokenizing the old ones again.
+"""
+class TokenFrequencyCube:
+    def __init__(self, terms, day_ids, person_codes, term_ids, counts, time_index):
+        self.terms = terms
+        self.is_bigram = np.array([" " in term for term in self.terms], dtype=bool)
+        # One entry per (day, person, term) cell that occurs
+        self.day_ids = day_ids
+        self.person_codes = person_codes
+        self.term_ids = term_ids
+        self.counts = counts
+        self.time_index = time_index
+        return
+
+
+    # Counts the words of the messages of `table` from row `start` on. Rows before it
+    # can be counted separately and merged in.
+    @classmethod
+    def from_table(cls, table, time_index, start=0):
+        terms = CategoryEncoder()
+        entry_rows, entry_terms = array("q"), array("l")
+        for row in cls.__get_wordcloud_rows(table, start).tolist():
+            for term in tokenize(table.clean_contents[row]):
+                entry_rows.append(row)
+                entry_terms.append(terms.code(term))
+        entry_rows = np.array(entry_rows, dtype=np.int64)
+        entry_terms = np.array(entry_terms, dtype=np.int64)
+
+        # Sum the occurrences of each (day, person, term)
+        num_names, num_terms = len(table.names), max(len(terms.values), 1)
+        cells = time_index.day_ids[entry_rows] * num_names + table.sender_codes[entry_rows]
+        keys, counts = np.unique(cells * num_terms + entry_terms, return_counts=True)
+        cells, term_ids = np.divmod(keys, num_terms)
+        day_ids, person_codes = np.divmod(cells, num_names)
+        return cls(terms.values, day_ids, person_codes, term_ids, counts, time_index)
+
+
+    # Cube of the words of both cubes, which must count messages of the same chat, with
+    # the same day ids and name codes. Keeps the TimeIndex of `other`.
+    def merge(self, other):
+        if len(other.counts) == 0:
+            return TokenFrequencyCube(self.terms, self.day_ids, self.person_codes, self.term_ids, self.counts, \
+                other.time_index)
+        terms = CategoryEncoder()
+        for term in self.terms + other.terms:
+            terms.code(term)
+        other_term_ids = np.array([terms.code(term) for term in other.terms], dtype=np.int64)[other.term_ids]
+
+        # Sum the cells that are in both
+        num_names = int(max(self.person_codes.max(initial=0), other.person_codes.max())) + 1
+        num_terms = len(terms.values)
+        cells = np.concatenate([self.day_ids * num_names + self.person_codes, \
+            other.day_ids * num_names + other.person_codes])
+        keys, inverse = np.unique(cells * num_terms + np.concatenate([self.term_ids, other_term_ids]), \
+            return_inverse=True)
+        counts = np.bincount(inverse, weights=np.concatenate([self.counts, other.counts]), minlength=len(keys))
+        cells, term_ids = np.divmod(keys, num_terms)
+        day_ids, person_codes = np.divmod(cells, num_names)
+        return TokenFrequencyCube(terms.values, day_ids, person_codes, term_ids, counts.astype(np.int64), \
+            other.time_index)
+
+
+    # The TimeIndex has an entry per message, so it isn't stored with the cube; `merge`
+    # takes the current one
+    def __getstate__(self):
+        return dict(self.__dict__, time_index=None)
+
+
+    # Rows of the messages that go into the word clouds
+    @staticmethod
+    def __get_wordcloud_rows(table, start=0):
+        candidates = np.flatnonzero((table.type_codes == table.type_code(GENERIC_MESSAGE_TYPE)) & table.has_content)
+        candidates = candidates[candidates >= start]
+        return np.array([row for row in candidates.tolist() if EXCLUDE_CALL_JOINED not in table.contents[row]], \
+            dtype=np.int64)
+
+
+    # Year of each cell, as TimeIndex year ids
+    def year_ids(self):
+        return self.time_index.year_ids_of_days(self.day_ids)
+
+
+    # Word frequencies of the cells where `mask` is set (all cells by default), as
+    # WordCloud.process_text would compute them from the text of those messages
+    def frequencies(self, mask=None):
+        term_ids, counts = self.term_ids, self.counts
+        if mask is not None:
+            term_ids, counts = term_ids[mask], counts[mask]
+        term_counts = np.bincount(term_ids, weights=counts, minlength=len(self.terms)).astype(np.int64)
+        used_terms = np.flatnonzero(term_counts)
+        unigram_counts = {self.terms[t]: int(term_counts[t]) for t in used_terms[~self.is_bigram[used_terms]]}
+        bigram_counts = {self.terms[t]: int(term_counts[t]) for t in used_terms[self.is_bigram[used_terms]]}
+        return collocated_frequencies(unigram_counts, bigram_counts)
+
+
+# The words of a text that WordCloud counts, followed by the pairs of consecutive
+# words that aren't stopwords, joined by a space
+def tokenize(text):
+    words = [word[:-2] if word.lower().endswith("'s") else word for word in TOKEN_PATTERN.findall(text)]
+    words = [word for word in words if not word.isdigit()]
+    is_stopword = [word.lower() in LOWERCASE_STOPWORDS for word in words]
+    unigrams = [word for word, stopword in zip(words, is_stopword) if not stopword]
+    bigrams = [words[i] + " " + words[i + 1] for i in range(len(words) - 1) \
+        if not is_stopword[i] and not is_stopword[i + 1]]
+    return unigrams + bigrams
+
+
+# Equivalent of wordcloud.tokenization.unigrams_and_bigrams, from counts instead of a word list
+def collocated_frequencies(unigram_counts, bigram_counts):
+    num_words = sum(unigram_counts.values())
+    counts_unigrams, standard_form = fold_token_counts(unigram_counts)
+    counts_bigrams, _ = fold_token_counts(bigram_counts)
+    original_counts = counts_unigrams.copy()
+
+    # Include bigrams that are also collocations
+    for bigram_string, count in counts_bigrams.items():
+        bigram = tuple(bigram_string.split(" "))
+        word1 = standard_form[bigram[0].lower()]
+        word2 = standard_form[bigram[1].lower()]
+        if score(count, original_counts[word1], original_counts[word2], num_words) > COLLOCATION_THRESHOLD:
+            counts_unigrams[word1] -= count
+            counts_unigrams[word2] -= count
+            counts_unigrams[bigram_string] = count
+    return {word: count for word, count in counts_unigrams.items() if count > 0}
+
+
+# Equivalent of wordcloud.tokenization.process_tokens, from counts instead of a word list:
+# each word takes its most common case, and plurals are merged into their singular
+def fold_token_counts(token_counts):
+    cases = defaultdict(dict)
+    for token, count in token_counts.items():
+        cases[token.lower()][token] = count
+
+    merged_plurals = {}
+    for key in list(cases.keys()):
+        if key.endswith("s") and not key.endswith("ss") and key[:-1] in cases:
+            singular_cases = cases[key[:-1]]
+            for token, count in cases[key].items():
+                singular_cases[token[:-1]] = singular_cases.get(token[:-1], 0) + count
+            merged_plurals[key] = key[:-1]
+            del cases[key]
+
+    fused_cases, standard_cases = {}, {}
+    for token_lower, case_counts in cases.items():
+        most_common_case = max(case_counts.items(), key=lambda item: item[1])[0]
+        fused_cases[most_common_case] = sum(case_counts.values())
+        standard_cases[token_lower] = most_common_case
+    for plural, singular in merged_plurals.items():
+        standard_cases[plural] = standard_cases[singular.lower()]
+    return fused_cases, standard_cases
@@ -1,107 +1,74 @@
 from wordcloud import WordCloud
-from datetime import datetime
-import os, string, re
+from pipeline.OutputManifest import OutputManifest, output_key
+from profiling.StageProfiler import profiled, instance_messages
+import numpy as np
+import os
 
 
 OUTPUT_DIRECTORY = "wordcloud/"
 OUTPUT_FILE_FORMAT = ".png"
-
-# JSON field names
-MESSAGE_TYPE = "type"
-GENERIC_MESSAGE_TYPE = "Generic"
-MESSAGE_CONTENT = "content"
-TIMESTAMP_MS = "timestamp_ms"
-SENDER_NAME = "sender_name"
-
-EXCLUDE_CALL_JOINED = "joined the video chat."
-WORDS_TO_REMOVE = [
-    "\u00f0\u009f\u0091\u0080", # eyes emoji
-    "\u00e2\u0080\u009c", # quotes
-    "\u00e2\u0080\u009d", # quotes
-    "â", "Â", "ð", "¤", "ï", "½", "§", "¢", "¥", "ª", "¦", '"',
-]
-EMOJI_PATTERN = r"(?:[^\s])(?<![\w{ascii_printable}])".format(ascii_printable=string.printable)
+WORDCLOUD_OPTIONS = {"width": 800, "height": 400, "max_words": 500, "background_color": "white"}
 
 
 """
-Class that takes in a list of messages and outputs WordCloud images.
+Class that takes in a TokenFrequencyCube and outputs WordCloud images.
 
 Word clouds generated:
 - over all messages
 - per year
 - per person
+
+Word clouds are the slowest outputs to render, so one whose frequencies haven't
+changed since it was last rendered (e.g. the cloud of a past year) is kept as it is.
 """
 class WordCloudGenerator:
-    def __init__(self, output_directory_path):
+    def __init__(self, output_directory_path, skip_unchanged=True):
         self.output_directory_path = output_directory_path + OUTPUT_DIRECTORY
+        self.manifest = OutputManifest(output_directory_path, enabled=skip_unchanged)
         return
 
 
-    def generate_wordclouds(self, messages):
-        messages = self.__preprocess_messages(messages)
-
+    def generate_wordclouds(self, table, token_cube):
+        self.num_messages = len(table)
         if not os.path.exists(self.output_directory_path):
             os.makedirs(self.output_directory_path)
 
         # All messages
-        self.__save_wordcloud_data("all_messages", messages)
+        self.__save_wordcloud_data("all_messages", token_cube.frequencies())
 
         # Messages per year
-        self.__generate_wordclouds_per_year(messages)
+        self.__generate_wordclouds_per_year(token_cube)
 
         # Messages per person
-        self.__generate_wordclouds_per_person(messages)
-
-
-    def __preprocess_messages(self, messages):
-        new_messages = []
-        for message in messages:
-            if message[MESSAGE_TYPE] != GENERIC_MESSAGE_TYPE:
-                continue
-            if MESSAGE_CONTENT not in message:
-                continue
-            if EXCLUDE_CALL_JOINED in message[MESSAGE_CONTENT]:
-                continue
-
-            # Note: WordCloud ignores words with contractions
-            message[MESSAGE_CONTENT] = message[MESSAGE_CONTENT].replace("\u00e2\u0080\u0099", "'")
-
-            # Remove emojis and other unprintable characters
-            message[MESSAGE_CONTENT] = re.sub(EMOJI_PATTERN, '', message[MESSAGE_CONTENT])
-            message[MESSAGE_CONTENT] = ''.join([c for c in message[MESSAGE_CONTENT] if c not in WORDS_TO_REMOVE])
-
-            new_messages.append(message)
-        return new_messages
-
-
-    def __generate_wordclouds_per_year(self, messages):
-        messages_by_year = {}
-        for message in messages:
-            year = datetime.fromtimestamp(message[TIMESTAMP_MS]/1000.0).year
-            if year not in messages_by_year:
-                messages_by_year[year] = [message]
-            else:
-                messages_by_year[year].append(message)
-
-        for year in messages_by_year:
-            self.__save_wordcloud_data("year_" + str(year), messages_by_year[year])
-
-
-    def __generate_wordclouds_per_person(self, messages):
-        messages_by_person = {}
-        for message in messages:
-            sender_name = message[SENDER_NAME]
-            if sender_name not in messages_by_person:
-                messages_by_person[sender_name] = [message]
-            else:
-                messages_by_person[sender_name].append(message)
-
-        for person in messages_by_person:
-            self.__save_wordcloud_data(person, messages_by_person[person])
-
-
-    def __save_wordcloud_data(self, filename, messages):
-        all_words = " ".join(m[MESSAGE_CONTENT] for m in messages)
-        
-        wordcloud = WordCloud(width=800, height=400, max_words=500, background_color="white").generate(all_words)
+        self.__generate_wordclouds_per_person(table, token_cube)
+        self.manifest.write()
+
+
+    @profiled(count=instance_messages)
+    def __generate_wordclouds_per_year(self, token_cube):
+        year_ids = token_cube.year_ids()
+        for year in np.unique(year_ids).tolist():
+            self.__save_wordcloud_data("year_" + str(token_cube.time_index.year_at(year)), \
+                token_cube.frequencies(year_ids == year))
+
+
+    @profiled(count=instance_messages)
+    def __generate_wordclouds_per_person(self, table, token_cube):
+        for person in np.unique(token_cube.person_codes).tolist():
+            self.__save_wordcloud_data(table.names[person], token_cube.frequencies(token_cube.person_codes == person))
+
+
+    # Renders one word cloud, which doesn't go through messages, so its number of
+    # messages is left out
+    @profiled(count=lambda result, self, filename, frequencies: None)
+    def __save_wordcloud_data(self, filename, frequencies):
+        # e.g. a chat without messages
+        if not frequencies:
+            return
+        paths = [OUTPUT_DIRECTORY + filename + OUTPUT_FILE_FORMAT]
+        key = output_key(sorted(frequencies.items()), WORDCLOUD_OPTIONS)
+        if self.manifest.is_current(paths, key):
+            return
+        wordcloud = WordCloud(**WORDCLOUD_OPTIONS).generate_from_frequencies(frequencies)
         wordcloud.to_file(self.output_directory_path + filename + OUTPUT_FILE_FORMAT)
+        self.manifest.record(paths, key)